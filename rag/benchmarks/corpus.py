@@ -0,0 +1,43 @@
+"""
+Corpus sintetici e riproducibili per i benchmark: file di testo con parole prese da un vocabolario fisso,
+distribuiti in sottocartelle. Stesso seed, stessi file (e quindi stessi hash e chunk).
+"""
+import os
+import random
+
+def vocabulary(size: int = 5000, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(size)]
+
+def paragraph(rng: random.Random, words: list[str]) -> str:
+    sentences = []
+    for _ in range(rng.randint(3, 8)):
+        sentence = " ".join(rng.choice(words) for _ in range(rng.randint(6, 20)))
+        sentences.append(sentence.capitalize() + ".")
+    return " ".join(sentences)
+
+def generate(path: str, files: int = 100, file_kb: int = 32, dirs: int = 10, seed: int = 0) -> list[str]:
+    """
+    Scrive files file di circa file_kb KiB sotto path e restituisce i loro percorsi.
+    """
+    rng = random.Random(seed)
+    words = vocabulary(seed=seed)
+    paths = []
+    for i in range(files):
+        folder = os.path.join(path, f"dir{i % max(1, dirs):03d}")
+        os.makedirs(folder, exist_ok=True)
+        file_path = os.path.join(folder, f"doc{i:05d}.txt")
+        size = 0
+        with open(file_path, "w", encoding="utf-8") as f:
+            while size < file_kb * 1024:
+                text = paragraph(rng, words) + "\n\n"
+                f.write(text)
+                size += len(text)
+        paths.append(file_path)
+    return paths
+
+def queries(count: int = 100, seed: int = 1, words_per_query: int = 4) -> list[str]:
+    rng = random.Random(seed)
+    words = vocabulary(seed=0)
+    return [" ".join(rng.choice(words) for _ in range(words_per_query)) for _ in range(count)]
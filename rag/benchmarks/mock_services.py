@@ -0,0 +1,297 @@
+"""
+Servizi finti per i benchmark, su un unico server HTTP locale:
+- Weaviate (/v1/...): schema, oggetti in memoria, batch import/delete, PATCH, e le Get GraphQL usate da RagApp
+  (anche più Get con alias; where con Equal/ContainsAny/And/Or/range, limit/offset, sort,
+  nearText/nearVector/bm25/hybrid con un punteggio per parole in comune);
+- Tika (PUT /tika): restituisce il contenuto del file come testo;
+- OIDC (POST /token): rilascia sempre lo stesso access token.
+
+Uso: python -m benchmarks.mock_services [--port 0] [--latency-ms 0]; stampa l'URL base su stdout.
+"""
+import argparse
+import json
+import re
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GET_BLOCK = re.compile(r"\bGet\s*\{")
+GET_ENTRY = re.compile(r"\s*(?:(\w+)\s*:\s*)?(\w+)\s*([({])")
+ARGUMENT_VARIABLE = re.compile(r"(\w+):\s*\$(\w+)")
+INLINE_LIMIT = re.compile(r"\blimit:\s*(\d+)")
+INLINE_OFFSET = re.compile(r"\boffset:\s*(\d+)")
+INLINE_AFTER = re.compile(r'\bafter:\s*"([^"]+)"')
+QUERY_MAXIMUM_RESULTS = 10000 # default di Weaviate
+INLINE_SORT = re.compile(r'\bsort:\s*\[\{path:\s*\["(\w+)"\],\s*order:\s*(asc|desc)\}')
+
+class Store:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.classes = {}
+        self.schema = {}
+
+    def objects(self, class_name):
+        return self.classes.setdefault(class_name, {})
+
+    def put(self, class_name, id, properties):
+        with self.lock:
+            self.objects(class_name)[id] = dict(properties)
+
+    def patch(self, class_name, id, properties):
+        with self.lock:
+            self.objects(class_name).setdefault(id, {}).update(properties)
+
+    def delete(self, class_name, where):
+        with self.lock:
+            objects = self.objects(class_name)
+            ids = [id for id, o in objects.items() if matches(id, o, where)]
+            for id in ids:
+                del objects[id]
+        return len(ids)
+
+    def select(self, class_name, where=None):
+        with self.lock:
+            return [(id, dict(o)) for id, o in self.objects(class_name).items() if where is None or matches(id, o, where)]
+
+def matches(id, o, where) -> bool:
+    operator = where["operator"]
+    if operator == "And":
+        return all(matches(id, o, w) for w in where["operands"])
+    if operator == "Or":
+        return any(matches(id, o, w) for w in where["operands"])
+
+    name = where["path"][0]
+    value = id if name == "id" else o.get(name)
+    expected = next(v for k, v in where.items() if k.startswith("value"))
+    if operator == "Equal":
+        if isinstance(value, str) and isinstance(expected, str):
+            # come Weaviate su un campo tokenizzato per spazi: devono esserci tutti i token del valore cercato
+            return set(expected.split()) <= set(value.split())
+        return value == expected
+    if operator == "ContainsAny":
+        if isinstance(value, str):
+            # come Weaviate su source (tokenizzazione per spazi): basta un token in comune
+            return bool(set(value.split()) & {token for e in expected for token in str(e).split()})
+        return value in expected
+    if value is None:
+        return False
+    if operator == "GreaterThanEqual":
+        return value >= expected
+    if operator == "LessThanEqual":
+        return value <= expected
+    raise ValueError("operatore non supportato: " + operator)
+
+def query_text(variables) -> str | None:
+    if "nearText" in variables:
+        return " ".join(variables["nearText"]["concepts"])
+    for name in ("bm25", "hybrid"):
+        if name in variables:
+            return variables[name]["query"]
+    if "nearVector" in variables:
+        return ""
+    return None
+
+def overlap_score(query: str, text: str) -> float:
+    words = set(query.lower().split())
+    if not words:
+        return 0.0
+    return len(words & set((text or "").lower().split())) / len(words)
+
+def closing(text: str, i: int) -> int:
+    # indice della parentesi che chiude quella aperta in text[i]
+    pair = {"(": ")", "{": "}"}[text[i]]
+    depth = 0
+    for j in range(i, len(text)):
+        if text[j] == text[i]:
+            depth += 1
+        elif text[j] == pair:
+            depth -= 1
+            if depth == 0:
+                return j
+    raise ValueError("parentesi non chiusa")
+
+def selected_properties(selection: str) -> set:
+    """
+    Le properties richieste in un blocco di selezione { ... } (_additional escluso).
+    """
+    names, depth = set(), 0
+    for token in re.findall(r"[{}]|\w+", selection):
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth -= 1
+        elif depth == 1:
+            names.add(token)
+    return names - {"_additional"}
+
+def get_entries(query: str):
+    """
+    Le Get del documento, anche più d'una con alias (alias: Classe(...) { ... }):
+    genera (nome nel risultato, classe, testo degli argomenti, blocco di selezione).
+    """
+    i = GET_BLOCK.search(query).end()
+    while True:
+        match = GET_ENTRY.match(query, i)
+        if match is None:
+            return
+        alias, class_name = match.group(1), match.group(2)
+        j = match.end() - 1
+        arguments = ""
+        if query[j] == "(":
+            k = closing(query, j)
+            arguments = query[j + 1:k]
+            j = query.index("{", k)
+        end = closing(query, j)
+        yield alias or class_name, class_name, arguments, query[j:end + 1]
+        i = end + 1
+
+def get_objects(store, class_name: str, arguments: str, selection: str, variables: dict):
+    # argomenti passati come variabili ($nome) e argomenti scritti nella query (limit, offset, after, sort)
+    values = {name: variables.get(variable) for name, variable in ARGUMENT_VARIABLE.findall(arguments)}
+    wanted = selected_properties(selection)
+    found = store.select(class_name, values.get("where"))
+
+    query = query_text(values)
+    vector_search = "nearText" in values or "nearVector" in values
+    if query is not None:
+        scored = sorted(((overlap_score(query, o.get("text")), id, o) for id, o in found), key=lambda x: -x[0])
+    else:
+        scored = [(None, id, o) for id, o in sorted(found, key=lambda x: x[0])]
+
+    sort = INLINE_SORT.search(arguments)
+    if sort:
+        name, order = sort.groups()
+        scored.sort(key=lambda s: (s[2].get(name) is None, s[2].get(name), s[1]), reverse=order == "desc")
+
+    after = INLINE_AFTER.search(arguments)
+    if after:
+        scored = [s for s in scored if s[1] > after.group(1)]
+
+    inline_limit = INLINE_LIMIT.search(arguments)
+    inline_offset = INLINE_OFFSET.search(arguments)
+    offset = values.get("offset") or (int(inline_offset.group(1)) if inline_offset else 0)
+    limit = values.get("limit") or (int(inline_limit.group(1)) if inline_limit else 25)  # QUERY_DEFAULTS_LIMIT
+    if offset + limit > QUERY_MAXIMUM_RESULTS:
+        raise ValueError(f"query maximum results exceeded: offset + limit > {QUERY_MAXIMUM_RESULTS}")
+
+    out = []
+    for score, id, o in scored[offset:offset + limit]:
+        additional = {"id": id}
+        if score is not None and vector_search:
+            # come Weaviate: nearText/nearVector hanno certainty e distance, lo score resta "0"
+            additional.update({"score": "0", "certainty": (1 + score) / 2, "distance": 1 - score})
+        elif score is not None:
+            additional.update({"score": str(score), "certainty": None, "distance": None})
+        out.append({**{k: v for k, v in o.items() if k in wanted}, "_additional": additional})
+    return out
+
+def graphql(store, body):
+    variables = body.get("variables") or {}
+    try:
+        return {"data": {"Get": {
+            name: get_objects(store, class_name, arguments, selection, variables)
+            for name, class_name, arguments, selection in get_entries(body["query"])
+        }}}
+    except ValueError as e:
+        return {"errors": [{"message": str(e)}]}
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    store = Store()
+    latency = 0.0
+
+    def setup(self):
+        super().setup()
+        # header e corpo partono in due write: senza TCP_NODELAY ogni risposta aspetta l'ACK ritardato del client
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def send(self, payload, status=200, content_type="application/json"):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        if self.latency:
+            time.sleep(self.latency)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.body()
+        if self.path.startswith("/token"):
+            return self.send({"access_token": "benchmark", "token_type": "Bearer", "expires_in": 3600})
+
+        body = json.loads(body)
+        if self.path == "/v1/graphql":
+            return self.send(graphql(self.store, body))
+        if self.path == "/v1/batch/objects":
+            for o in body["objects"]:
+                self.store.put(o["class"], o["id"], o["properties"])
+            return self.send([{**o, "result": {}} for o in body["objects"]])
+        if self.path == "/v1/schema":
+            self.store.schema[body["class"]] = body
+            return self.send(body)
+        if self.path.startswith("/v1/schema/") and self.path.endswith("/properties"):
+            definition = self.store.schema.get(self.path.split("/")[3])
+            if definition is None:
+                return self.send({"error": "not found"}, 404)
+            definition.setdefault("properties", []).append(body)
+            return self.send(body)
+        if self.path == "/v1/objects":
+            id = body.get("id") or str(uuid.uuid4())
+            self.store.put(body["class"], id, body["properties"])
+            return self.send({**body, "id": id})
+        self.send({"error": "not found"}, 404)
+
+    def do_GET(self):
+        if self.path.startswith("/v1/schema/"):
+            definition = self.store.schema.get(self.path.split("/")[3])
+            if definition is not None:
+                return self.send(definition)
+        self.send({"error": "not found"}, 404)
+
+    def do_PATCH(self):
+        body = json.loads(self.body())
+        _, _, _, class_name, id = self.path.split("?")[0].split("/")
+        self.store.patch(class_name, id, body.get("properties") or {})
+        self.send(b"", 204)
+
+    def do_DELETE(self):
+        body = json.loads(self.body() or b"{}")
+        if self.path == "/v1/batch/objects":
+            n = self.store.delete(body["match"]["class"], body["match"]["where"])
+            return self.send({"results": {"matches": n, "successful": n, "failed": 0}})
+        self.send(b"", 204)
+
+    def do_PUT(self):
+        # Tika: i file del corpus sono testo, quindi l'estrazione è il contenuto stesso
+        data = self.body()
+        self.send(data, content_type="text/plain; charset=utf-8")
+
+def start(port: int = 0, latency_ms: float = 0.0):
+    Handler.latency = latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    args.add_argument("--port", type=int, default=0)
+    args.add_argument("--latency-ms", type=float, default=0.0, help="ritardo simulato per risposta")
+    options = args.parse_args()
+
+    server, url = start(options.port, options.latency_ms)
+    print(url, flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,160 @@
+"""
+Benchmark di ingest e ricerca di RagApp contro i servizi finti di mock_services (Weaviate, Tika, OIDC),
+su un corpus sintetico. Scrive i risultati in JSON, da confrontare tra un commit e l'altro.
+
+Uso (dalla cartella rag/): python -m benchmarks.run --files 200 --file-kb 32 --output bench.json
+"""
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing_extensions import Annotated
+from typer import Typer, Option, echo
+
+from benchmarks import corpus
+
+app = Typer()
+
+def start_services(latency_ms: float):
+    # processo separato: la memoria e la CPU del finto Weaviate non entrano nelle misure
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.mock_services", "--latency-ms", str(latency_ms)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdout=subprocess.PIPE,
+        text=True
+    )
+    return process, process.stdout.readline().strip()
+
+def configure_environment(url: str, workdir: str):
+    os.environ["TIKA_EXTRACT_ENDPOINT"] = url + "/tika"
+    os.environ["OIDC_TOKEN_ENDPOINT"] = url + "/token"
+    os.environ["OIDC_CLIENT_ID"] = "benchmark"
+    os.environ["OIDC_CLIENT_SECRET"] = "benchmark"
+    os.environ["TOKEN_FILE"] = os.path.join(workdir, "token.json")
+
+def percentiles(samples: list[float]) -> dict:
+    ms = [s * 1000 for s in samples]
+    if len(ms) < 2:
+        return {"count": len(ms), "p50_ms": ms[0] if ms else None, "p95_ms": None, "p99_ms": None}
+    cuts = statistics.quantiles(ms, n=100, method="inclusive")
+    return {
+        "count": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 3),
+        "p50_ms": round(cuts[49], 3),
+        "p95_ms": round(cuts[94], 3),
+        "p99_ms": round(cuts[98], 3)
+    }
+
+def timed(func, texts) -> list[float]:
+    samples = []
+    for text in texts:
+        began = time.perf_counter()
+        func(text)
+        samples.append(time.perf_counter() - began)
+    return samples
+
+def count_chunks(app) -> int:
+    return sum(1 for _ in app.get_weaviate_client().iter_objects("DocumentChunk", ["chunk_id"], 1000))
+
+def peak_rss_mb() -> float:
+    # ru_maxrss è in KiB su Linux, in byte su macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+@app.command()
+def run(
+    files: Annotated[int, Option("--files", help="File nel corpus sintetico", show_default=True)] = 100,
+    file_kb: Annotated[int, Option("--file-kb", help="Dimensione di ogni file in KiB", show_default=True)] = 32,
+    queries: Annotated[int, Option("--queries", help="Ricerche per tipo", show_default=True)] = 200,
+    k: Annotated[int, Option("--k", "-k", help="Top-k delle ricerche", show_default=True)] = 3,
+    neighbors: Annotated[int, Option("--neighbors", "-n", help="Vicini per risultato", show_default=True)] = 1,
+    workers: Annotated[int, Option("--workers", "-w", help="Thread per stadio di ingest (1 = sequenziale)", show_default=True)] = 1,
+    stream: Annotated[bool, Option("--stream", help="Ingest in streaming", show_default=True)] = False,
+    latency_ms: Annotated[float, Option("--latency-ms", help="Ritardo simulato per risposta dei servizi finti", show_default=True)] = 0.0,
+    seed: Annotated[int, Option("--seed", help="Seed del corpus", show_default=True)] = 0,
+    output: Annotated[str, Option("--output", "-o", help="File JSON dei risultati (vuoto = solo stdout)")] = ""
+):
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as workdir:
+        process, url = start_services(latency_ms)
+        try:
+            configure_environment(url, workdir)
+            # import dopo l'ambiente: auth legge le variabili OIDC alla prima sessione
+            from rag.app import RagApp
+            from rag.metrics import metrics
+
+            corpus_path = os.path.join(workdir, "corpus")
+            paths = corpus.generate(corpus_path, files, file_kb, seed=seed)
+
+            app = RagApp(url, None)
+            app.streaming = stream
+
+            began = time.perf_counter()
+            failures = app.ingest_path(corpus_path, recursive=True, workers=workers) or []
+            ingest_seconds = time.perf_counter() - began
+            chunks = count_chunks(app)
+
+            began = time.perf_counter()
+            app.ingest_path(corpus_path, recursive=True, workers=workers)
+            reingest_seconds = time.perf_counter() - began
+
+            texts = corpus.queries(queries, seed=seed + 1)
+            client = app.get_weaviate_client()
+            results = {
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "params": {
+                    "files": files, "file_kb": file_kb, "queries": queries, "k": k, "neighbors": neighbors,
+                    "workers": workers, "stream": stream, "latency_ms": latency_ms, "seed": seed
+                },
+                "ingest": {
+                    "files": len(paths),
+                    "failed": len(failures),
+                    "chunks": chunks,
+                    "seconds": round(ingest_seconds, 3),
+                    "files_per_s": round(len(paths) / ingest_seconds, 2),
+                    "chunks_per_s": round(chunks / ingest_seconds, 2),
+                    "unchanged_reingest_seconds": round(reingest_seconds, 3)
+                },
+                "query": {
+                    "near_text": percentiles(timed(lambda text: app.chunks_near_text(text, k, neighbors), texts)),
+                    "hybrid": percentiles(timed(lambda text: app.hybrid(text, k=k, neighbors=neighbors), texts)),
+                    "super_search_where": percentiles(timed(
+                        lambda path: client.super_search(
+                            "DocumentChunk",
+                            {"where": {"operator": "Equal", "path": ["source"], "valueString": path}, "limit": k},
+                            properties=["source", "chunk_id", "text"],
+                            additional=["id"],
+                            neighbors=neighbors
+                        ),
+                        [paths[i % len(paths)] for i in range(queries)]
+                    ))
+                },
+                "connections": client.connection_stats(),
+                "metrics": metrics.snapshot(),
+                "peak_rss_mb": peak_rss_mb()
+            }
+            client.close()
+        finally:
+            process.terminate()
+            process.wait()
+
+    report = json.dumps(results, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    echo(report)
+
+if __name__ == "__main__":
+    app()
@@ -1,12 +1,21 @@
 import os
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from typing import Callable
 from rag.weaviate_client import WeaviateClient
 from rag.auth import get_oauth_session
+from rag.parallel_ingest import StagePipeline
+from collections import Counter
 from datetime import datetime, timezone
 from dateutil import parser
 from functools import lru_cache
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from hashlib import sha256
+from requests import RequestException
+from threading import Lock
+from rag.embeddings import vectorizer_text
+from rag.metrics import metrics
 
 @lru_cache(maxsize=1)
 def get_splitter(chunk_size=500, chunk_overlap=100):
@@ -18,44 +27,120 @@ def get_splitter(chunk_size=500, chunk_overlap=100):
 
 def split_text_with_langchain(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> list[str]:
     splitter = get_splitter(chunk_size, chunk_overlap)
-    return splitter.split_text(text)
-
-def file_func_call(
-    path: str,
-    func: Callable[[str, int, str], None],
-    recursive: bool = False
-):
+    with metrics.timer("split"):
+        return splitter.split_text(text)
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    """
+    SHA-256 del file: con mmap l'intero file viene passato a hashlib in una sola chiamata (che rilascia il GIL),
+    altrimenti (file vuoti, filesystem senza mmap) letture da block_size.
+    """
+    h = sha256()
+    with metrics.timer("file_hash"), open(path, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                h.update(m)
+        except (ValueError, OSError):
+            f.seek(0)
+            buffer = bytearray(block_size)
+            view = memoryview(buffer)
+            while n := f.readinto(buffer):
+                h.update(view[:n])
+    return h.hexdigest()
+
+def file_prehash(path: str, size: int, block_size: int = 65536) -> str:
+    """
+    Hash economico di size, primo e ultimo blocco: se cambia il file è cambiato,
+    se coincide (insieme a size e m_time) il file si considera invariato senza leggerlo tutto.
+    """
+    h = sha256(str(size).encode())
+    with open(path, 'rb') as f:
+        h.update(f.read(block_size))
+        if size > block_size:
+            f.seek(max(block_size, size - block_size))
+            h.update(f.read(block_size))
+    return h.hexdigest()
+
+def chunk_hash(text: str) -> str:
+    return sha256(text.encode("utf-8")).hexdigest()
+
+def file_stat(path: str):
+    abs_path = os.path.abspath(path)
+    size = os.path.getsize(path)
+    mtime = os.path.getmtime(path)
+    modified_time = datetime.fromtimestamp(mtime, timezone.utc)
+    return abs_path, size, modified_time
+
+def iter_files(path: str, recursive: bool = False):
+    """
+    Genera (abs_path, size, modified_time) per ogni file sotto path.
+    """
     if not os.path.exists(path):
         raise FileNotFoundError(f"Il percorso '{path}' non esiste.")
 
     if os.path.isfile(path):
-        abs_path = os.path.abspath(path)
-        size = os.path.getsize(path)
-        mtime = os.path.getmtime(path)
-        modified_time = datetime.fromtimestamp(mtime, timezone.utc)
-        func(abs_path, size, modified_time)
+        yield file_stat(path)
 
     elif os.path.isdir(path):
         if not recursive:
             raise ValueError(f"Il percorso '{path}' è una directory ma 'recursive' è False.")
         for root, dirs, files in os.walk(path):
             for file in files:
-                full_path = os.path.join(root, file)
-                file_func_call(full_path, func, recursive)
+                try:
+                    stat = file_stat(os.path.join(root, file))
+                except OSError as e: # file rimosso o non accessibile durante la scansione
+                    print("skipping", os.path.join(root, file), ":", e)
+                    continue
+                yield stat
 
     else:
         raise ValueError(f"Il percorso '{path}' non è né file né directory.")
-def put_tika(path_to_file: str) -> str:
 
-    session = get_oauth_session()
+def file_func_call(
+    path: str,
+    func: Callable[[str, int, str], None],
+    recursive: bool = False
+):
+    for abs_path, size, modified_time in iter_files(path, recursive):
+        func(abs_path, size, modified_time)
 
+def iter_split_text(pieces, chunk_size: int = 1000, chunk_overlap: int = 200, window: int | None = None):
+    """
+    Come split_text_with_langchain, ma su un iterabile di frammenti di testo: genera i chunk man mano,
+    tenendo in memoria al più window caratteri (default 8 * chunk_size).
+    Lo split riparte ogni volta dall'ultimo chunk, che potrebbe continuare nel frammento successivo.
+    """
+    splitter = get_splitter(chunk_size, chunk_overlap)
+    window = window or chunk_size * 8
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) >= window:
+            with metrics.timer("split"):
+                chunks = splitter.split_text(buffer)
+            if len(chunks) > 1:
+                yield from chunks[:-1]
+                buffer = buffer[buffer.rfind(chunks[-1]):]
+    if buffer:
+        with metrics.timer("split"):
+            chunks = splitter.split_text(buffer)
+        yield from chunks
+
+def get_tika_endpoint() -> str:
     tika_extract_endpoint = os.getenv("TIKA_EXTRACT_ENDPOINT")
     if not tika_extract_endpoint:
         raise EnvironmentError("TIKA_EXTRACT_ENDPOINT not found in environment variables.")
+    return tika_extract_endpoint
+
+def put_tika(path_to_file: str) -> str:
+
+    session = get_oauth_session()
+
+    tika_extract_endpoint = get_tika_endpoint()
 
     headers = {"Accept": "text/plain"}
     try:
-        with open(path_to_file, 'rb') as f:
+        with metrics.timer("tika"), open(path_to_file, 'rb') as f:
             response = session.put(tika_extract_endpoint, data=f, headers=headers)
             response.raise_for_status()
             response.encoding = "utf-8"
@@ -64,16 +149,60 @@ def put_tika(path_to_file: str) -> str:
     except Exception as e:
         raise
 
+def put_tika_stream(path_to_file: str, piece_size: int = 65536):
+    """
+    Come put_tika, ma genera il testo estratto a frammenti mentre Tika lo restituisce.
+    """
+    session = get_oauth_session()
+
+    tika_extract_endpoint = get_tika_endpoint()
+
+    headers = {"Accept": "text/plain"}
+    with open(path_to_file, 'rb') as f:
+        with session.put(tika_extract_endpoint, data=f, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            response.encoding = "utf-8"
+            # si misura solo l'attesa dei frammenti, non il tempo in cui il consumatore li elabora
+            pieces = response.iter_content(piece_size, decode_unicode=True)
+            while True:
+                with metrics.timer("tika_stream"):
+                    piece = next(pieces, None)
+                if piece is None:
+                    return
+                yield piece
+
 class RagApp:
-    def __init__(self, url, weaviate_api_key):
+    def __init__(self, url, weaviate_api_key, **client_options):
         self.url = url
         self.weaviate_api_key = weaviate_api_key
-        self.weaviate_client = WeaviateClient(url, weaviate_api_key)
+        self.weaviate_client = WeaviateClient(url, weaviate_api_key, **client_options)
+        self.batch_size = 100
+        self.manifest = None
+        self.streaming = False
+        self.store_document_text = True
+        self.hash_workers = 2
+        self.dedup_batch_size = 1000
+        self.pending_hashes = {}
+        self.known_documents = {}
+        self.known_duplicates = {}
+        self.replica = None
+        self.embedder = None
+        self.offline = False
+        self.client_embeddings = False
+        self.vectorize_class_name = True
+        self.embed_batch_size = 64
+        self.embed_workers = 2
+        self.embed_executor = None
+        self.embed_lock = Lock()
 
     def get_weaviate_client(self):
         return self.weaviate_client
 
     def get_document_by_file_path(self, file_path : str):
+        # risultato già ottenuto dalla ricerca massiva di plan_files
+        if file_path in self.known_documents:
+            return self.known_documents.pop(file_path)
+
         result = self.weaviate_client.super_search(
             "Document",
             { "where": 
@@ -83,7 +212,7 @@ class RagApp:
                     "valueString" : file_path
                 }
             },
-            properties=["size", "source","m_time", "vectorized","hash"],
+            properties=["size", "source","m_time", "vectorized","hash","prehash"],
             additional=["id"]
         )
         result_length = len (result)
@@ -95,22 +224,80 @@ class RagApp:
 
         return None
     
-    def get_chunks_by_file_path(self, file_path : str):
-        result = self.weaviate_client.super_search(
-            "DocumentChunk",
-            { "where": 
+    def find_documents(self, property_name: str, values: list, properties: list, page_size: int = 200):
+        """
+        Document con property_name in values, con una query Or di Equal ogni page_size valori,
+        letta a pagine finché non arriva una pagina incompleta.
+        Non si usa ContainsAny: source è tokenizzata per spazi e basterebbe un token in comune (es. "My Documents")
+        per far corrispondere migliaia di Document, oltre QUERY_MAXIMUM_RESULTS.
+        Anche Equal confronta i token, quindi i risultati sono filtrati sul valore esatto.
+        """
+        values = list(values)
+        properties = list(dict.fromkeys([*properties, property_name]))
+        result = []
+        for start in range(0, len(values), page_size):
+            page = values[start:start + page_size]
+            wanted = set(page)
+            operands = [
                 {
                     "operator": "Equal",
-                    "path" : ["source"],
-                    "valueString" : file_path
+                    "path" : [property_name],
+                    "valueString" : value
                 }
-            },
-            properties=["size", "source","m_time"],
-            additional=["id"]
-        )
-
+                for value in page
+            ]
+            where = operands[0] if len(operands) == 1 else {"operator": "Or", "operands": operands}
+            offset = 0
+            while True:
+                found = self.weaviate_client.super_search(
+                    "Document",
+                    { "where": where,
+                      "limit": page_size,
+                      "offset": offset
+                    },
+                    properties=properties,
+                    additional=["id"]
+                )
+                result.extend(doc for doc in found if doc.get(property_name) in wanted)
+                if len(found) < page_size:
+                    break
+                offset += len(found)
         return result
 
+    def iter_chunks_by_file_path(self, file_path : str, page_size: int = 1000):
+        """
+        Generatore sui DocumentChunk di file_path in ordine di chunk_id, a pagine di page_size.
+        Ogni pagina riparte dall'ultimo chunk_id letto invece che da un offset:
+        Weaviate rifiuta offset + limit oltre QUERY_MAXIMUM_RESULTS (default 10000).
+        """
+        first = 0
+        seen = set() # id già restituiti con chunk_id == first (chunk_id duplicati a cavallo di due pagine)
+        while True:
+            page = self.weaviate_client.super_search(
+                "DocumentChunk",
+                { "where":
+                    {
+                        "operator": "And",
+                        "operands": [
+                            {"path": ["source"], "operator": "Equal", "valueString": file_path},
+                            {"path": ["chunk_id"], "operator": "GreaterThanEqual", "valueInt": first}
+                        ]
+                    },
+                  "sort": [{"path": ["chunk_id"], "order": "asc"}],
+                  "limit": page_size
+                },
+                properties=["source", "chunk_id", "chunk_hash"],
+                additional=["id"]
+            )
+            fresh = [o for o in page if self.get_id_from_object(o) not in seen]
+            yield from fresh
+            if len(page) < page_size or not fresh:
+                return
+            first = page[-1]["chunk_id"]
+            seen = {self.get_id_from_object(o) for o in page if o["chunk_id"] == first}
+
+    def get_chunks_by_file_path(self, file_path : str, page_size: int = 1000):
+        return list(self.iter_chunks_by_file_path(file_path, page_size))
 
     def get_id_from_object(self, object):
         return object["_additional"]["id"]
@@ -122,14 +309,130 @@ class RagApp:
             return None
         return self.get_id_from_object(result)
 
-    def ingest_chunks(self, text, source):
-        chunks = split_text_with_langchain(text)
-        n = len(chunks)
+    def sync_chunks(self, chunks, source, window: int = 1000):
+        """
+        Allinea i DocumentChunk di source ai nuovi chunks (lista o generatore) confrontando gli hash del contenuto:
+        i chunk invariati restano (con il loro vettore) e al più cambiano chunk_id via PATCH,
+        vengono inseriti solo i chunk nuovi e cancellati solo quelli scomparsi.
+        Il chunk i viene confrontato solo con i chunk esistenti con chunk_id entro i +/- window, letti a pagine:
+        chunk nuovi, esistenti e cancellazioni procedono insieme e la memoria non dipende dalla dimensione del documento.
+        Un chunk spostato di più di window posizioni viene reinserito.
+        Restituisce (numero di chunk, chunk inseriti, errori di import dei chunk nuovi).
+        """
+        existing = self.iter_chunks_by_file_path(source)
+        pending = next(existing, None)
+        loaded = {} # id -> chunk esistente non ancora abbinato, in ordine di chunk_id
+        by_hash = {}
+
+        objects = []
+        errors = []
+        vanished = []
+        inserted = 0
+        renumbered = 0
+        deleted = 0
+        n = 0
+
+        def flush():
+            nonlocal inserted
+            vectors = self.embed_chunks(objects) if self.client_embeddings and objects else None
+            with metrics.timer("upload"):
+                _, batch_errors = self.weaviate_client.ingest_batch("DocumentChunk", objects, batch_size=self.batch_size, vectors=vectors)
+            for error in batch_errors:
+                error["chunk_id"] = objects[error["index"]]["chunk_id"]
+                print("chunk", error["chunk_id"], "failed:", error["errors"])
+            errors.extend(batch_errors)
+            inserted += len(objects) - len(batch_errors)
+            objects.clear()
+
+        def delete_vanished():
+            nonlocal deleted
+            if vanished:
+                self.weaviate_client.delete_objects(
+                    "DocumentChunk",
+                    {
+                        "path": ["id"],
+                        "operator": "ContainsAny",
+                        "valueTextArray": vanished
+                    }
+                )
+                deleted += len(vanished)
+                vanished.clear()
+
+        def forget(o):
+            del loaded[self.get_id_from_object(o)]
+            by_hash[o.get("chunk_hash")].remove(o)
+
+        def vanish(o):
+            forget(o)
+            vanished.append(self.get_id_from_object(o))
+            if len(vanished) >= 500:
+                delete_vanished()
+
         for i, chunk in enumerate(chunks):
-            print("Processing CHUNK", i+1, "of", n)
-            self.weaviate_client.ingest("DocumentChunk", text=chunk, source=source, chunk_id=i)
+            n += 1
+            # i chunk inseriti hanno chunk_id <= i, già oltre le pagine lette: non tornano tra gli esistenti
+            while pending is not None and pending["chunk_id"] <= i + window:
+                loaded[self.get_id_from_object(pending)] = pending
+                by_hash.setdefault(pending.get("chunk_hash"), []).append(pending)
+                pending = next(existing, None)
+            while loaded and next(iter(loaded.values()))["chunk_id"] < i - window:
+                vanish(next(iter(loaded.values())))
+
+            h = chunk_hash(chunk)
+            candidates = by_hash.get(h)
+            if candidates:
+                o = min(candidates, key=lambda c: abs(c["chunk_id"] - i))
+                forget(o)
+                if o["chunk_id"] != i:
+                    self.weaviate_client.patch_object("DocumentChunk", self.get_id_from_object(o), {"properties": {"chunk_id": i}})
+                    renumbered += 1
+            else:
+                objects.append({"text": chunk, "source": source, "chunk_id": i, "chunk_hash": h})
+                if len(objects) >= self.batch_size * 4:
+                    flush()
+        flush()
+
+        for o in list(loaded.values()):
+            vanish(o)
+        while pending is not None:
+            vanished.append(self.get_id_from_object(pending))
+            if len(vanished) >= 500:
+                delete_vanished()
+            pending = next(existing, None)
+        delete_vanished()
+
+        metrics.inc("chunks", n - inserted - len(errors), result="kept")
+        metrics.inc("chunks", renumbered, result="renumbered")
+        metrics.inc("chunks", inserted, result="inserted")
+        metrics.inc("chunks", len(errors), result="failed")
+        metrics.inc("chunks", deleted, result="deleted")
+        print(
+            "Chunks:", n - inserted - len(errors), "kept,", renumbered, "renumbered,",
+            inserted, "of", inserted + len(errors), "inserted,", deleted, "deleted"
+        )
+        return n, inserted, errors
+
+    def embed_chunks(self, objects):
+        """
+        Vettori dei chunk calcolati lato client: batch di embed_batch_size testi per chiamata, al più embed_workers
+        chiamate in volo (l'executor è condiviso tra i file ingestati in parallelo).
+        Se l'embedder non risponde restituisce None e i chunk vengono vettorizzati da Weaviate.
+        """
+        with self.embed_lock:
+            if self.embed_executor is None:
+                self.embed_executor = ThreadPoolExecutor(max_workers=self.embed_workers, thread_name_prefix="embed")
+
+        texts = [vectorizer_text("DocumentChunk", o["text"], self.vectorize_class_name) for o in objects]
+        batches = [texts[start:start + self.embed_batch_size] for start in range(0, len(texts), self.embed_batch_size)]
+        try:
+            with metrics.timer("embed"):
+                return [vector for vectors in self.embed_executor.map(self.embedder.embed, batches) for vector in vectors]
+        except RequestException as e:
+            print("embedding lato client fallito, vettorizza Weaviate:", e)
+            return None
 
     def delete_objects_by_source(self, class_name: str, source: str):
+        self.weaviate_client.invalidate_source(source)
         self.weaviate_client.delete_objects(
             class_name,
             {
@@ -140,31 +443,77 @@ class RagApp:
         )
 
     def delete_documents_by_source(self, source: str):
+        if self.manifest is not None:
+            self.manifest.delete(source)
         self.delete_objects_by_source("Document", source)
 
     def delete_chunks_by_source(self, source: str):
         self.delete_objects_by_source("DocumentChunk", source)
         
-    def pipeline(self, file_path, size, m_time, hash):
+    def pipeline(self, file_path, size, m_time, hash, doc_id=None):
+        if self.streaming:
+            # il testo completo viene raccolto solo se serve salvarlo nel Document
+            collected = [] if self.store_document_text else None
+            pieces = put_tika_stream(file_path)
+            if collected is not None:
+                pieces = (collected.append(piece) or piece for piece in pieces)
+            self.store(file_path, size, m_time, hash, doc_id, collected, iter_split_text(pieces))
+            return
+
         extracted_text = put_tika(file_path)
-        result = self.weaviate_client.ingest("Document", text=extracted_text, source=file_path, size=size, m_time = m_time.isoformat(), vectorized=False, hash=hash)
-        id = result["id"]
-        self.ingest_chunks(extracted_text, file_path)
-        self.weaviate_client.patch_object("Document", id, {"properties": {"vectorized": True}})
+        self.store(file_path, size, m_time, hash, doc_id, extracted_text if self.store_document_text else None, split_text_with_langchain(extracted_text))
+
+    def store(self, file_path, size, m_time, hash, doc_id, extracted_text, chunks):
+        """
+        Scrive i chunk e poi il Document: un Document presente e vectorized=True implica chunk completi.
+        extracted_text può essere None (testo non salvato) o la lista dei frammenti raccolti durante lo streaming dei chunks.
+        """
+        count, inserted, errors = self.sync_chunks(chunks, file_path)
+        if inserted:
+            # testo nuovo: può rispondere anche a ricerche in cache che oggi restituiscono altre source
+            self.weaviate_client.invalidate_all()
+        else:
+            self.weaviate_client.invalidate_source(file_path)
+        metrics.inc("files", result="failed" if errors else "ingested")
 
+        properties = {"source": file_path, "size": size, "m_time": m_time.isoformat(), "vectorized": not errors, "hash": hash, "prehash": file_prehash(file_path, size)}
+        if extracted_text is not None:
+            properties["text"] = extracted_text if isinstance(extracted_text, str) else "".join(extracted_text)
+        else:
+            # il PATCH è un merge: senza text resterebbe quello della versione precedente del file
+            properties["text"] = ""
+
+        if doc_id is None:
+            doc_id = self.weaviate_client.ingest("Document", **properties)["id"]
+        else:
+            self.weaviate_client.patch_object("Document", doc_id, {"properties": properties})
+
+        # con errori resta vectorized=False e verrà reingestato alla prossima scansione
+        if not errors and self.manifest is not None:
+            self.manifest.put(file_path, size, m_time.isoformat(), hash, doc_id, count)
 
-    def get_hash(self, file_path):
-        h = sha256()
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(32768), b''):
-                h.update(chunk)
 
-        return h.hexdigest()
+    def get_hash(self, file_path):
+        # usa l'hash calcolato in anticipo da ingest_path, se presente
+        with metrics.timer("get_hash"):
+            future = self.pending_hashes.pop(file_path, None)
+            if future is not None and not future.cancelled():
+                return future.result()
+            return file_hash(file_path)
+
+    def discard_hash(self, file_path):
+        future = self.pending_hashes.pop(file_path, None)
+        if future is not None:
+            future.cancel()
 
     def is_duplicated_by_hash(self, file_path):
         
         hash = self.get_hash(file_path)
 
+        # risultato già ottenuto dalla deduplica massiva di plan_files
+        if file_path in self.known_duplicates:
+            return self.known_duplicates.pop(file_path), hash
+
         # search hash in weaviate
         result = self.weaviate_client.super_search(
             "Document",
@@ -178,45 +527,214 @@ class RagApp:
             properties=["hash","source"]
         )
 
-        return result, hash
+        # il Document del file stesso non è un duplicato: cancellarne i chunk lo lascerebbe vectorized senza chunk
+        return [doc for doc in result if doc["source"] != file_path], hash
+
+    def stat_matches(self, doc, size, m_time):
+        # se vero basta confrontare il prehash per sapere se il file è invariato
+        return doc["size"] == size and parser.parse(doc["m_time"]) == m_time and doc["vectorized"] and bool(doc.get("prehash"))
+
+    def check_file(self, file_path, size, m_time):
+        """
+        Decide se il file va (re)ingestato: restituisce (hash, id del Document esistente o None),
+        oppure None se va saltato.
+        Con il manifest, un file con size e m_time invariati viene saltato senza chiamate di rete.
+        """
+        if self.manifest is not None and self.manifest.is_unchanged(file_path, size, m_time.isoformat()):
+            return None
 
-    def ingest_file(self, file_path, size, m_time):
-        print("processing file:", file_path)
-        
         doc = self.get_document_by_file_path(file_path)
         
         if doc is None:
-            self.delete_chunks_by_source(file_path) # per sicurezza, potremmo aver cancellato il documento padre e ci potrebbero essere chunks orfani
             hash_duplicates, hash = self.is_duplicated_by_hash(file_path)
             if hash_duplicates:
+                self.delete_chunks_by_source(file_path) # per sicurezza, potremmo aver cancellato il documento padre e ci potrebbero essere chunks orfani
                 print("skipping, is hash a duplicate of:", hash_duplicates)
-            else:
-                self.pipeline(file_path, size, m_time, hash)
+                return None
+            return hash, None # eventuali chunks orfani vengono riusati o rimossi da sync_chunks
                       
+        parsed = parser.parse(doc["m_time"])
+
+        if self.stat_matches(doc, size, m_time) and doc["prehash"] == file_prehash(file_path, size):
+            # invariato: non serve lo SHA-256 completo
+            self.discard_hash(file_path)
+            hash = doc["hash"]
+
         else:
-            parsed = parser.parse(doc["m_time"])
             hash = self.get_hash(file_path)
 
-            if doc["size"] != size or parsed != m_time or not doc["vectorized"] or doc["hash"] != hash:
-                print("*** Document modified or not properly vectorized reingesting", file_path)
-                self.delete_documents_by_source(file_path)
-                self.delete_chunks_by_source(file_path)
-                self.pipeline(file_path, size, m_time, hash)
-            else:
-                pass
-                #print("skipping", file_path)
+        if doc["size"] != size or parsed != m_time or not doc["vectorized"] or doc["hash"] != hash:
+            print("*** Document modified or not properly vectorized reingesting", file_path)
+            return hash, self.get_id_from_object(doc)
 
-    def ingest_path(self, path: str, recursive: bool = False):
-        return file_func_call(path, self.ingest_file, recursive)
+        #print("skipping", file_path)
+        if self.manifest is not None:
+            self.manifest.put(file_path, size, m_time.isoformat(), hash, self.get_id_from_object(doc), None)
+        return None
+
+    def ingest_file(self, file_path, size, m_time):
+        print("processing file:", file_path)
+        
+        checked = self.check_file(file_path, size, m_time)
+        if checked is not None:
+            hash, doc_id = checked
+            self.pipeline(file_path, size, m_time, hash, doc_id)
+
+    def plan_files(self, files, executor):
+        """
+        Fase massiva prima dell'ingest, a blocchi di dedup_batch_size file:
+        - scarta i file invariati secondo il manifest
+        - cerca i Document esistenti con poche query ContainsAny sulle source
+        - calcola in parallelo gli hash dei file nuovi (e di quelli probabilmente modificati)
+        - risolve i duplicati con query ContainsAny sugli hash e tra i file della stessa esecuzione
+        Genera i file da processare; check_file userà i risultati senza altre query per file.
+        """
+        seen_hashes = {}
+        files = iter(files)
+        while batch := list(islice(files, self.dedup_batch_size)):
+            if self.manifest is not None:
+                batch = [item for item in batch if not self.manifest.is_unchanged(item[0], item[1], item[2].isoformat())]
+
+            documents = {
+                doc["source"]: doc
+                for doc in self.find_documents("source", [item[0] for item in batch], ["size", "source", "m_time", "vectorized", "hash", "prehash"])
+            }
+
+            new_files = []
+            for file_path, size, m_time in batch:
+                doc = documents.get(file_path)
+                self.known_documents[file_path] = doc
+                if doc is None:
+                    new_files.append(file_path)
+                if doc is None or not self.stat_matches(doc, size, m_time):
+                    self.pending_hashes[file_path] = executor.submit(file_hash, file_path)
+
+            hashes = {}
+            for file_path in new_files:
+                try:
+                    hashes[file_path] = self.pending_hashes[file_path].result()
+                except OSError as e: # verrà ritentato (e segnalato) da check_file
+                    print("hash failed for", file_path, ":", e)
+
+            known = {}
+            for doc in self.find_documents("hash", set(hashes.values()), ["size", "source", "m_time", "vectorized", "hash", "prehash"]):
+                known.setdefault(doc["hash"], []).append(doc)
+
+            for file_path, hash in hashes.items():
+                own = next((doc for doc in known.get(hash, []) if doc["source"] == file_path), None)
+                if own is not None:
+                    # Document del file sfuggito alla ricerca per source: non è un duplicato di sé stesso
+                    self.known_documents[file_path] = own
+                    self.known_duplicates[file_path] = []
+                elif hash in known:
+                    self.known_duplicates[file_path] = known[hash]
+                elif hash in seen_hashes:
+                    self.known_duplicates[file_path] = [{"hash": hash, "source": seen_hashes[hash]}]
+                else:
+                    seen_hashes[hash] = file_path
+                    self.known_duplicates[file_path] = []
+
+            yield from batch
+
+    def forget_file(self, file_path):
+        self.discard_hash(file_path)
+        self.known_documents.pop(file_path, None)
+        self.known_duplicates.pop(file_path, None)
+
+    def forget_all(self):
+        for future in self.pending_hashes.values():
+            future.cancel()
+        self.pending_hashes.clear()
+        self.known_documents.clear()
+        self.known_duplicates.clear()
+
+    def ingest_path(self, path: str, recursive: bool = False, workers: int = 1):
+        if workers > 1:
+            return self.ingest_path_parallel(path, recursive, workers)
+
+        with ThreadPoolExecutor(max(1, self.hash_workers), thread_name_prefix="hash") as executor:
+            try:
+                for item in self.plan_files(iter_files(path, recursive), executor):
+                    self.ingest_prefetched(*item)
+            finally:
+                self.forget_all()
+
+    def ingest_prefetched(self, file_path, size, m_time):
+        try:
+            self.ingest_file(file_path, size, m_time)
+        finally:
+            self.forget_file(file_path)
+
+    def ingest_path_parallel(self, path: str, recursive: bool, workers: int):
+        """
+        Ingestion concorrente: discovery -> hash/verifica -> estrazione Tika -> split -> upload a batch,
+        ogni stadio con workers thread e code limitate tra uno stadio e l'altro.
+        Restituisce la lista dei file falliti.
+        """
+        def check(file_path, size, m_time):
+            print("processing file:", file_path)
+            try:
+                checked = self.check_file(file_path, size, m_time)
+            finally:
+                self.forget_file(file_path)
+            return None if checked is None else (file_path, size, m_time, *checked)
+
+        def extract(file_path, size, m_time, hash, doc_id):
+            return (file_path, size, m_time, hash, doc_id, put_tika(file_path))
+
+        def split(file_path, size, m_time, hash, doc_id, extracted_text):
+            return (file_path, size, m_time, hash, doc_id, extracted_text if self.store_document_text else None, split_text_with_langchain(extracted_text))
+
+        if self.streaming:
+            # estrazione, split e upload procedono insieme sullo stesso flusso di testo
+            stages = [("hash", check), ("upload", self.pipeline)]
+        else:
+            stages = [("hash", check), ("tika", extract), ("split", split), ("upload", self.store)]
+
+        pipeline = StagePipeline(stages, workers=workers)
+        with ThreadPoolExecutor(max(1, self.hash_workers), thread_name_prefix="hash") as executor:
+            try:
+                return pipeline.run(self.plan_files(iter_files(path, recursive), executor))
+            finally:
+                self.forget_all()
     
-    def get_documents(self):
-        return self.weaviate_client.get_objects("Document",["text","source","vectorized"])['data']['Get']['Document']
+    def reconcile_manifest(self, page_size: int = 1000):
+        """
+        Ricostruisce il manifest leggendo a pagine tutti i Document vettorizzati e il numero di chunk per source.
+        """
+        chunk_counts = Counter(
+            o["source"] for o in self.weaviate_client.iter_objects("DocumentChunk", ["source"], page_size)
+        )
+
+        entries = (
+            {
+                "source": doc["source"],
+                "size": doc["size"],
+                "m_time": parser.parse(doc["m_time"]).isoformat(),
+                "hash": doc["hash"],
+                "doc_id": self.get_id_from_object(doc),
+                "chunk_count": chunk_counts.get(doc["source"], 0)
+            }
+            for doc in self.weaviate_client.iter_objects("Document", ["source", "size", "m_time", "hash", "vectorized"], page_size)
+            if doc["vectorized"]
+        )
+
+        self.manifest.replace_all(entries)
+        return self.manifest.count()
+
+    def sync_replica(self, page_size=500):
+        return self.replica.sync(self.weaviate_client, "DocumentChunk", page_size)
+
+    def get_documents(self, page_size: int = 1000, with_text: bool = False):
+        # Document.text è il testo intero del file: solo se richiesto, con pagine piccole
+        fields = ["source", "vectorized", *(["text"] if with_text else [])]
+        return self.weaviate_client.iter_objects("Document", fields, page_size)
     
-    def get_chunks(self):
-        return self.weaviate_client.get_objects("DocumentChunk",["text","source","chunk_id"])['data']['Get']['DocumentChunk']
+    def get_chunks(self, page_size: int = 1000):
+        return self.weaviate_client.iter_objects("DocumentChunk", ["text","source","chunk_id"], page_size)
 
     def bm25(self, class_name, text):
-        return self.weaviate_client.super_search(
+        return self.weaviate_client.cached_search(
             class_name,
             {
                 "bm25": {
@@ -235,7 +753,63 @@ class RagApp:
             ]
         )
     
+    def hybrid(self, text, alpha=0.5, fusion_type="relativeScoreFusion", k=3, neighbors=0, rerank=False):
+        return self.weaviate_client.hybrid(
+            "DocumentChunk",
+            text,
+            properties=[
+                "source",
+                "m_time",
+                "text"
+            ],
+            additional=[
+                "id",
+                "score"
+            ],
+            alpha=alpha,
+            fusion_type=fusion_type,
+            k=k,
+            neighbors=neighbors,
+            rerank=rerank
+        )
+
     def chunks_near_text(self, text, k, neighbors):
+        # con una replica locale (e l'embedder per la query) Weaviate serve solo da ripiego, o per niente se offline
+        vector = None
+        if self.embedder is not None:
+            try:
+                vector = self.embedder.embed_query(text)
+            except RequestException:
+                if self.offline:
+                    raise
+
+        if self.replica is not None and vector is not None:
+            try:
+                return self.replica.near_vector(vector, k, neighbors)
+            except LookupError:
+                if self.offline:
+                    raise
+        elif self.offline:
+            raise RuntimeError("modalità offline: servono una replica locale e un embedder")
+
+        if vector is not None:
+            # vettore già calcolato (e in cache): Weaviate non deve vettorizzare di nuovo la domanda
+            return self.weaviate_client.nearVector(
+                "DocumentChunk",
+                vector,
+                properties=[
+                    "source",
+                    "m_time",
+                    "text"
+                ],
+                additional=[
+                    "id",
+                    "score"
+                ],
+                k=k,
+                neighbors=neighbors
+            )
+
         return self.weaviate_client.nearText(
             "DocumentChunk",
             text,
@@ -0,0 +1,190 @@
+import time
+import httpx
+
+from typing import List, Dict
+from rag.metrics import metrics
+from rag.weaviate_client import (
+    BatchSizer,
+    batch_errors,
+    batch_payload,
+    build_ask_query,
+    build_generate_query,
+    build_search_query,
+    delete_payload,
+    endpoint_label,
+    hybrid_fields,
+    merge_neighbors,
+    near_text_fields,
+    neighbor_windows,
+    neighbors_where,
+    query_variables,
+    search_results,
+    sort_by_index,
+    sort_by_rerank,
+    windows_size,
+)
+
+class AsyncWeaviateClient:
+    """
+    Versione asyncio di WeaviateClient per i chiamanti che girano in un event loop (es. i tool di Open WebUI):
+    stessa interfaccia di ricerca, ma le richieste non bloccano il loop e condividono un pool httpx.AsyncClient.
+    """
+    def __init__(self, url, weaviate_api_key, pool_size: int = 10, keep_alive: bool = True, connect_timeout: float = 5.0, read_timeout: float = 60.0, http2: bool = False):
+        self.url = url.rstrip('/')+'/'
+        self.headers = {
+            "Content-Type": "application/json",
+            **({"Authorization": "Bearer " + weaviate_api_key} if weaviate_api_key else {})
+        }
+        self.session = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size if keep_alive else 0),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+        )
+
+    async def close(self):
+        await self.session.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        await self.close()
+
+    def api_build_url(self, name, additional=None, version="v1"):
+        url = self.url+version+'/'+name
+        if additional:
+            url += "/" + additional
+        return url
+
+    async def api_request(self, method, name, body=None, additional="", version="v1"):
+        url = self.api_build_url(name, additional, version)
+        with metrics.timer("weaviate_request", method=method, endpoint=endpoint_label(name + "/" + (additional or ""))):
+            resp = await self.session.request(method, url, json=body, headers=self.headers)
+            resp.raise_for_status()
+            return resp.json()
+
+    async def api_post(self, name, body, additional="", version="v1"):
+        return await self.api_request("POST", name, body, additional, version)
+
+    async def super_search(self, class_name: str, variables: Dict, properties: List = [], additional : List = [], neighbors = 0, neighbors_index_name="chunk_id", key_property_name="source"):
+
+        q = build_search_query(class_name, variables, properties, additional)
+
+        resp = await self.api_post("graphql", {
+            "query": q,
+            "variables": query_variables(variables)
+        })
+
+        objects = search_results(resp, class_name)
+
+        objects = await self.expand_neighbors(class_name, objects, properties, additional, neighbors, neighbors_index_name, key_property_name)
+
+        return sort_by_index(objects, neighbors_index_name)
+
+    async def expand_neighbors(self, class_name: str, objects: List[Dict], properties: List, additional: List, neighbors: int, neighbors_index_name="chunk_id", key_property_name="source") -> List[Dict]:
+        if neighbors <= 0 or not objects:
+            return objects
+
+        with metrics.timer("neighbor_expansion"):
+            return await self.fetch_neighbors(class_name, objects, properties, additional, neighbors, neighbors_index_name, key_property_name)
+
+    async def fetch_neighbors(self, class_name: str, objects: List[Dict], properties: List, additional: List, neighbors: int, neighbors_index_name: str, key_property_name: str) -> List[Dict]:
+        windows = neighbor_windows(objects, neighbors, neighbors_index_name, key_property_name)
+        neighbor_objs = await self.super_search(
+            class_name,
+            variables={
+                "where": neighbors_where(windows, neighbors_index_name, key_property_name),
+                "limit": windows_size(windows),
+            },
+            properties=properties,
+            additional=additional,
+            neighbors=0,
+            neighbors_index_name=neighbors_index_name,
+            key_property_name=key_property_name
+        )
+        return merge_neighbors(objects, neighbor_objs, neighbors_index_name, key_property_name)
+
+    async def nearText(self, class_name: str, text: str, properties : list[str], additional: list[str], k: int = 1, neighbors: int = 1, neighbors_property_name: str = "chunk_id", same_property_name: str = "source"):
+
+        properties, additional = near_text_fields(properties, additional, neighbors, neighbors_property_name)
+
+        return await self.super_search(
+            class_name,
+            {
+                "nearText": {
+                    "concepts": [text],
+                },
+                "limit": k
+            },
+            properties=properties,
+            additional=additional,
+            neighbors=neighbors,
+            neighbors_index_name=neighbors_property_name,
+            key_property_name=same_property_name
+        )
+
+    async def hybrid(self, class_name: str, text: str, properties: list[str], additional: list[str], alpha: float = 0.5, fusion_type: str = "relativeScoreFusion", k: int = 3, neighbors: int = 0, rerank: bool = False, rerank_property: str = "text", rerank_candidates: int | None = None, neighbors_property_name: str = "chunk_id", same_property_name: str = "source"):
+        """
+        Come WeaviateClient.hybrid (senza cache).
+        """
+        properties, additional = hybrid_fields(properties, additional, neighbors, neighbors_property_name)
+
+        variables = {
+            "hybrid": {
+                "query": text,
+                "alpha": alpha,
+                "fusionType": fusion_type
+            },
+            "limit": (rerank_candidates or k * 4) if rerank else k
+        }
+        if rerank:
+            variables["rerankQuery"] = text
+
+        q = build_search_query(class_name, variables, properties, additional, rerank_property if rerank else None)
+        objects = search_results(await self.api_post("graphql", {"query": q, "variables": query_variables(variables)}), class_name)
+        if rerank:
+            objects = sort_by_rerank(objects, k)
+        return await self.expand_neighbors(class_name, objects, properties, additional, neighbors, neighbors_property_name, same_property_name)
+
+    async def ask(self, question: str, properties: list[str] | None = None, limit: int = 1, certainty: float | None = None):
+        resp = await self.api_post("graphql", {"query": build_ask_query(question, properties, limit, certainty)})
+        return resp.get("data", {}).get("Get", {}).get("DocumentChunk", [])
+
+    async def generate(self, query: str, prompt: str, k: int = 1, alpha: float | None = None):
+        resp = await self.api_post("graphql", {"query": build_generate_query(query, prompt, k, alpha)})
+        return resp.get("data", {}).get("Get", {}).get("DocumentChunk", [])
+
+    async def delete_objects(self, class_name: str, where: Dict):
+        return await self.api_request("DELETE", "batch", delete_payload(class_name, where), "objects")
+
+    async def ingest_batch(self, class_name, objects: List[Dict], batch_size: int = 100, max_batch_size: int = 1000, target_seconds: float = 2.0, vectors: List[List[float]] | None = None):
+        """
+        Come WeaviateClient.ingest_batch: restituisce (results, errors).
+        """
+        payload = batch_payload(class_name, objects, vectors)
+        sizer = BatchSizer(batch_size, max_batch_size, target_seconds)
+
+        results = []
+        errors = []
+        start = 0
+
+        while start < len(payload):
+            batch = payload[start:start + sizer.size]
+            began = time.monotonic()
+            try:
+                resp = await self.api_post("batch", {"objects": batch}, "objects")
+            except httpx.TimeoutException:
+                if sizer.retry(None):
+                    continue
+                raise
+            except httpx.HTTPStatusError as e:
+                if sizer.retry(e.response.status_code):
+                    continue
+                raise
+
+            sizer.update(time.monotonic() - began)
+            errors.extend(batch_errors(batch, resp, start))
+            results.extend(resp)
+            start += len(batch)
+
+        return results, errors
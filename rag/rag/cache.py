@@ -0,0 +1,161 @@
+import copy
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import List, Dict
+
+def cache_key(class_name: str, variables: Dict, properties: List, additional: List, k: int | None, neighbors: int) -> str:
+    return json.dumps(
+        [class_name, variables, properties, additional, k, neighbors],
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str
+    )
+
+def result_sources(objects: List[Dict], key_property_name: str = "source") -> set:
+    return {o[key_property_name] for o in objects if o.get(key_property_name) is not None}
+
+class MemoryCache:
+    """
+    Cache LRU in memoria dei risultati di ricerca, con scadenza ttl (secondi, None = nessuna scadenza).
+    Ogni voce ricorda le source dei suoi risultati, così update e delete possono invalidarla;
+    l'ingest di chunk nuovi svuota invece tutta la cache (possono entrare nei risultati di qualunque ricerca).
+    """
+    def __init__(self, maxsize: int = 256, ttl: float | None = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (entry[1] is not None and entry[1] < time.time()):
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[0])
+
+    def set(self, key, value, sources: set = frozenset()):
+        expires = time.time() + self.ttl if self.ttl else None
+        with self.lock:
+            self.entries[key] = (copy.deepcopy(value), expires, set(sources))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate_source(self, source: str):
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if source in entry[2]]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+class SQLiteCache:
+    """
+    Come MemoryCache ma persistente su file SQLite, quindi condivisa tra esecuzioni e processi diversi.
+    """
+    def __init__(self, path: str = "query_cache.sqlite", maxsize: int = 10000, ttl: float | None = 3600):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires REAL,
+                accessed REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS cache_sources (
+                key TEXT NOT NULL,
+                source TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS cache_sources_source ON cache_sources(source);
+            CREATE INDEX IF NOT EXISTS cache_sources_key ON cache_sources(key);
+        """)
+
+    def delete_keys(self, keys):
+        self.db.executemany("DELETE FROM cache WHERE key = ?", [(k,) for k in keys])
+        self.db.executemany("DELETE FROM cache_sources WHERE key = ?", [(k,) for k in keys])
+
+    def get(self, key):
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                if row is not None:
+                    self.delete_keys([key])
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key, value, sources: set = frozenset()):
+        now = time.time()
+        expires = now + self.ttl if self.ttl else None
+        with self.lock, self.db:
+            self.delete_keys([key])
+            self.db.execute(
+                "INSERT INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires, now)
+            )
+            self.db.executemany("INSERT INTO cache_sources (key, source) VALUES (?, ?)", [(key, s) for s in sources])
+            overflow = self.db.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.maxsize
+            if overflow > 0:
+                oldest = self.db.execute("SELECT key FROM cache ORDER BY accessed LIMIT ?", (overflow,)).fetchall()
+                self.delete_keys([k for (k,) in oldest])
+
+    def invalidate_source(self, source: str):
+        with self.lock, self.db:
+            keys = self.db.execute("SELECT DISTINCT key FROM cache_sources WHERE source = ?", (source,)).fetchall()
+            self.delete_keys([k for (k,) in keys])
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM cache")
+            self.db.execute("DELETE FROM cache_sources")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        with self.lock:
+            entries = self.db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+def make_cache(backend: str, maxsize: int | None = None, ttl: float | None = None, path: str | None = None):
+    if backend in (None, "", "none"):
+        return None
+    if backend == "memory":
+        return MemoryCache(maxsize or 256, ttl)
+    if backend == "sqlite":
+        return SQLiteCache(path or "query_cache.sqlite", maxsize or 10000, ttl)
+    raise ValueError(f"Backend di cache '{backend}' non supportato (none, memory, sqlite)")
@@ -1,38 +1,181 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
 from langchain_groq.chat_models import ChatGroq
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import get_buffer_string
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT, QA_PROMPT
+from langchain.memory import ConversationBufferMemory, ConversationSummaryBufferMemory
 from weaviate_client import WeaviateClient
 from weaviate_retriever import WeaviateRetriever
+from context import estimate_tokens, pack_context, format_context
 
+MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+
+class TokenPrinter(BaseCallbackHandler):
+    """
+    Stampa i token della risposta man mano che arrivano e misura il tempo al primo token dall'inizio del turno.
+    """
+    def __init__(self):
+        self.started = None
+        self.first_token = None
+
+    def start_turn(self):
+        self.started = time.perf_counter()
+        self.first_token = None
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        print(token, end="", flush=True)
+
+    def time_to_first_token(self) -> float | None:
+        if self.first_token is None:
+            return None
+        return self.first_token - self.started
+
+def estimated_token_ids(text: str) -> list[int]:
+    return [0] * estimate_tokens(text)
+
+class TokenCounter(BaseCallbackHandler):
+    """
+    Somma i token (stimati) dei prompt inviati al modello nel turno: riformulazione, risposta e riassunto della memoria.
+    """
+    def __init__(self):
+        self.sent = 0
+
+    def start_turn(self):
+        self.sent = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.sent += sum(estimate_tokens(get_buffer_string(m)) for m in messages)
+
+def print_sources(docs, limit: int = 2):
+    if not docs:
+        return
+    print("\nFonti:")
+    for i, doc in enumerate(docs[:limit]):  # Limita le fonti per brevità
+        print(f"{i+1}. {doc.metadata['source']} #{doc.metadata['chunk_id']} (score {doc.metadata['score']}): {doc.page_content[:100]}...")
+
+
+def document_objects(docs) -> list[dict]:
+    # i Document del retriever nella forma degli oggetti Weaviate usata da pack_context
+    return [
+        {
+            "source": doc.metadata["source"],
+            "chunk_id": doc.metadata["chunk_id"],
+            "text": doc.page_content,
+            "_additional": {"score": doc.metadata.get("score")}
+        }
+        for doc in docs
+    ]
+
+class ChatPipeline:
+    """
+    Sostituisce ConversationalRetrievalChain con gli stessi prompt, ma senza chiamate LLM inutili:
+    - senza storia (o con meno di min_history_turns scambi) la domanda va direttamente al retriever;
+    - altrimenti la riformulazione della domanda e una retrieval speculativa sulla domanda originale partono
+      in parallelo: se la domanda riformulata coincide con l'originale si usa la retrieval già fatta.
+    """
+    def __init__(self, llm, answer_llm, retriever, memory, min_history_turns: int = 1, context_tokens: int = 3000):
+        self.llm = llm
+        self.answer_llm = answer_llm
+        self.retriever = retriever
+        self.memory = memory
+        self.min_history_turns = min_history_turns
+        self.context_tokens = context_tokens
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    def history(self):
+        return self.memory.load_memory_variables({})["chat_history"]
+
+    def needs_condense(self, history) -> bool:
+        if not history:
+            return False
+        # ConversationSummaryBufferMemory riassume i turni che superano il budget in un SystemMessage:
+        # se c'è un riassunto la storia c'è, anche senza messaggi human rimasti
+        if any(m.type == "system" and m.content for m in history):
+            return True
+        turns = max(1, sum(1 for m in history if m.type == "human"))
+        return turns >= self.min_history_turns
+
+    def condense(self, question: str, history) -> str:
+        prompt = CONDENSE_QUESTION_PROMPT.format(chat_history=get_buffer_string(history), question=question)
+        return self.llm.invoke(prompt).content.strip()
+
+    def retrieve(self, question: str, history):
+        if not self.needs_condense(history):
+            return question, self.retriever.invoke(question)
+
+        condensed = self.executor.submit(self.condense, question, history)
+        speculative = self.executor.submit(self.retriever.invoke, question)
+
+        generated = condensed.result() or question
+        if generated.strip().lower() == question.strip().lower():
+            return question, speculative.result()
+
+        # la retrieval speculativa non serve più: se è ancora in coda non parte
+        speculative.cancel()
+        return generated, self.retriever.invoke(generated)
+
+    def invoke(self, inputs: dict) -> dict:
+        question = inputs["question"]
+        generated, docs = self.retrieve(question, self.history())
+
+        context = format_context(pack_context(document_objects(docs), self.context_tokens))
+        answer = self.answer_llm.invoke(QA_PROMPT.format(context=context, question=generated)).content
+
+        self.memory.save_context({"question": question}, {"answer": answer})
+        return {
+            "question": question,
+            "generated_question": generated,
+            "answer": answer,
+            "source_documents": docs
+        }
 
 def run_chat(
     client: WeaviateClient,
     groq_api_key: str,
     k: int = 3,
-    neighbors: int = 1
+    neighbors: int = 1,
+    search: str = "nearText",
+    alpha: float = 0.5,
+    stream: bool = False,
+    memory_tokens: int = 0,
+    context_tokens: int = 3000
 ):
     """
-    Avvia una sessione interattiva di chat RAG
+    Avvia una sessione interattiva di chat RAG.
+    Con stream la risposta viene stampata token per token e per ogni turno viene riportato il tempo al primo token.
+    Con memory_tokens > 0 la storia è limitata a quel budget: gli ultimi scambi restano integrali,
+    i precedenti vengono riassunti man mano; altrimenti la storia cresce senza limiti.
+    I chunk trovati sono fusi per source (senza ripetizioni né sovrapposizioni) entro context_tokens.
     """
     # Prepariamo retriever e modello
-    retriever = WeaviateRetriever(client=client, k=k, neighbors=neighbors)
-    llm = ChatGroq(api_key=groq_api_key, model="meta-llama/llama-4-scout-17b-16e-instruct")
-    
-    # Configurazione corretta della memoria specificando l'output_key
-    memory = ConversationBufferMemory(
-        memory_key="chat_history",
-        return_messages=True,
-        output_key="answer"  # Specifichiamo esplicitamente quale output memorizzare
-    )
+    retriever = WeaviateRetriever(client=client, k=k, neighbors=neighbors, search=search, alpha=alpha)
+    counter = TokenCounter()
+    llm = ChatGroq(api_key=groq_api_key, model=MODEL, callbacks=[counter], custom_get_token_ids=estimated_token_ids)
 
-    qa = ConversationalRetrievalChain.from_llm(
-        llm,
-        retriever=retriever,
-        memory=memory,
-        return_generated_question=True,
+    # in streaming serve un secondo modello per la risposta: la riformulazione della domanda non va stampata
+    printer = TokenPrinter()
+    answer_llm = ChatGroq(api_key=groq_api_key, model=MODEL, streaming=True, callbacks=[printer, counter]) if stream else llm
 
-        return_source_documents=True  # Questo crea più output ('answer' e 'source_documents')
-    )
+    # Configurazione corretta della memoria specificando l'output_key
+    if memory_tokens > 0:
+        memory = ConversationSummaryBufferMemory(
+            llm=llm,
+            max_token_limit=memory_tokens,
+            memory_key="chat_history",
+            return_messages=True,
+            output_key="answer"
+        )
+    else:
+        memory = ConversationBufferMemory(
+            memory_key="chat_history",
+            return_messages=True,
+            output_key="answer"  # Specifichiamo esplicitamente quale output memorizzare
+        )
+
+    qa = ChatPipeline(llm, answer_llm, retriever, memory, context_tokens=context_tokens)
 
     print("🚀 Avvio chat (digita EXIT o QUIT per uscire) 🚀")
     print("ℹ️  Per domande senza contesto documentale, inizia con: !norag")
@@ -43,19 +186,28 @@ def run_chat(
             print("👋 Chat terminata.")
             break
 
+        printer.start_turn()
+        counter.start_turn()
         if q.strip().lower().startswith("!norag"):
             q_clean = q.strip()[6:].strip()
-            # Memoria manuale anche per no-RAG
-            memory.chat_memory.add_user_message(q_clean)
-            response = llm.invoke(q_clean)
-            memory.chat_memory.add_ai_message(response.content)
-            print(response.content.strip())
+            if stream:
+                answer = "".join(chunk.content for chunk in answer_llm.stream(q_clean))
+                print()
+            else:
+                answer = llm.invoke(q_clean).content
+                print(answer.strip())
+            # Memoria manuale anche per no-RAG (save_context applica anche il budget della memoria)
+            memory.save_context({"question": q_clean}, {"answer": answer})
         else:
             resp = qa.invoke({"question": q})
-            print(resp.get("answer", "").strip())
-            
+            if stream:
+                print()
+            else:
+                print(resp.get("answer", "").strip())
+
             # Opzionale: mostra le fonti se presenti
-            if "source_documents" in resp and resp["source_documents"]:
-                print("\nFonti:")
-                for i, doc in enumerate(resp["source_documents"][:2]):  # Limita a 2 fonti per brevità
-                    print(f"{i+1}. {doc.page_content[:100]}...")  # Mostra i primi 100 caratteri del contenuto
\ No newline at end of file
+            print_sources(resp.get("source_documents"))
+
+        if stream and printer.time_to_first_token() is not None:
+            print(f"\n⏱️  primo token dopo {printer.time_to_first_token():.2f}s")
+        print(f"📨 ~{counter.sent} token inviati")
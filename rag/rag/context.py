@@ -0,0 +1,78 @@
+from typing import List, Dict
+from rag.weaviate_client import rerank_score
+
+def estimate_tokens(text: str) -> int:
+    # stima grossolana (~4 caratteri per token): basta per i budget, senza scaricare tokenizer
+    return len(text) // 4 + 1
+
+def strip_overlap(previous: str, text: str, max_overlap: int = 400, min_overlap: int = 20) -> str:
+    """
+    Toglie da text il prefisso che ripete la coda di previous (il chunk_overlap dello splitter).
+    Sotto min_overlap caratteri una coincidenza è considerata casuale e il testo resta invariato.
+    """
+    for size in range(min(max_overlap, len(previous), len(text)), min_overlap - 1, -1):
+        if previous.endswith(text[:size]):
+            return text[size:]
+    return text
+
+def object_score(o: Dict) -> float | None:
+    additional = o.get("_additional") or {}
+    if additional.get("rerank"):
+        return rerank_score(o)
+    # nearText/nearVector: certainty (o 1 - distance); lo score vale "0" e serve solo per bm25/hybrid
+    if additional.get("certainty") is not None:
+        return float(additional["certainty"])
+    if additional.get("distance") is not None:
+        return 1.0 - float(additional["distance"])
+    if additional.get("score") is not None:
+        # Weaviate restituisce lo score hybrid/bm25 come stringa
+        return float(additional["score"])
+    return None
+
+def merge_runs(objects: List[Dict], neighbors_index_name: str = "chunk_id", key_property_name: str = "source", max_overlap: int = 400) -> List[Dict]:
+    """
+    Raggruppa i chunk per source, elimina i doppioni e fonde le sequenze di chunk_id contigui in un unico passaggio,
+    senza la sovrapposizione dello splitter. Ogni passaggio ha source, first, last, text e score (il migliore dei suoi chunk;
+    i vicini senza score non lo abbassano).
+    """
+    by_source = {}
+    for o in objects:
+        by_source.setdefault(o[key_property_name], {}).setdefault(o[neighbors_index_name], o)
+
+    runs = []
+    for source, chunks in by_source.items():
+        run = None
+        for cid in sorted(chunks):
+            o = chunks[cid]
+            if run is not None and cid == run["last"] + 1:
+                run["text"] += strip_overlap(run["text"], o.get("text") or "", max_overlap)
+                run["last"] = cid
+                run["score"] = max(run["score"], object_score(o) or 0.0)
+            else:
+                run = {"source": source, "first": cid, "last": cid, "text": o.get("text") or "", "score": object_score(o) or 0.0}
+                runs.append(run)
+    return runs
+
+def pack_context(objects: List[Dict], token_budget: int = 3000, neighbors_index_name: str = "chunk_id", key_property_name: str = "source", max_overlap: int = 400) -> List[Dict]:
+    """
+    Passaggi da mandare al modello: merge_runs in ordine di score decrescente, finché stanno nel budget di token.
+    L'ultimo passaggio che non ci sta intero viene troncato; l'ordine per source e chunk_id è poi ripristinato.
+    """
+    packed = []
+    remaining = token_budget
+    for run in sorted(merge_runs(objects, neighbors_index_name, key_property_name, max_overlap), key=lambda r: r["score"], reverse=True):
+        if remaining <= 0:
+            break
+        tokens = estimate_tokens(run["text"])
+        if tokens > remaining:
+            run["text"] = run["text"][:remaining * 4]
+            tokens = remaining
+        packed.append(run)
+        remaining -= tokens
+    return sorted(packed, key=lambda r: (r["source"], r["first"]))
+
+def format_context(passages: List[Dict]) -> str:
+    return "\n\n".join(
+        f"[{p['source']} #{p['first']}-{p['last']}]\n{p['text']}"
+        for p in passages
+    )
@@ -0,0 +1,93 @@
+import json
+import re
+import requests
+from typing import List
+from rag.cache import MemoryCache, SQLiteCache
+
+def schema_vectorizer(schema_path: str, class_name: str = "DocumentChunk") -> dict:
+    """
+    Endpoint e modello text2vec-ollama configurati per class_name in schema.json, così gli embedding
+    calcolati lato client sono gli stessi che produrrebbe Weaviate.
+    """
+    with open(schema_path, "r", encoding="utf-8") as f:
+        definitions = json.load(f)
+    return definitions[class_name]["moduleConfig"]["text2vec-ollama"]
+
+def vectorizer_text(class_name: str, text: str, vectorize_class_name: bool = True) -> str:
+    """
+    Il testo che text2vec-ollama vettorizza per un oggetto con la sola property text: con vectorizeClassName
+    (default di Weaviate) è preceduto dal nome della classe in minuscolo e separato per parole ("document chunk").
+    """
+    if not vectorize_class_name:
+        return text
+    return re.sub(r"(?<!^)(?=[A-Z])", " ", class_name).lower() + " " + text
+
+class OllamaEmbedder:
+    """
+    Embedding tramite l'API /api/embed di Ollama (stesso modello del modulo text2vec-ollama di Weaviate).
+    """
+    def __init__(self, endpoint: str = "http://localhost:11434", model: str = "nomic-embed-text", timeout: float = 60.0):
+        self.endpoint = endpoint.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        resp = self.session.post(
+            self.endpoint + "/api/embed",
+            json={"model": self.model, "input": texts},
+            timeout=self.timeout
+        )
+        resp.raise_for_status()
+        return resp.json()["embeddings"]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed([text])[0]
+
+    def close(self):
+        self.session.close()
+
+def normalize_query(text: str) -> str:
+    # domande che differiscono solo per maiuscole o spazi danno lo stesso embedding in cache
+    return " ".join(text.split()).casefold()
+
+class CachedEmbedder:
+    """
+    Embedder con cache delle query: LRU in memoria davanti a un archivio SQLite facoltativo (persistente tra esecuzioni).
+    La chiave è modello + testo normalizzato, quindi una domanda già vista non passa più dal modello.
+    """
+    def __init__(self, embedder: OllamaEmbedder, maxsize: int = 1024, path: str | None = None):
+        self.embedder = embedder
+        self.memory = MemoryCache(maxsize, ttl=None)
+        self.store = SQLiteCache(path, maxsize=100000, ttl=None) if path else None
+
+    @property
+    def model(self):
+        return self.embedder.model
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return self.embedder.embed(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self.embedder.model + "\n" + normalize_query(text)
+
+        vector = self.memory.get(key)
+        if vector is None and self.store is not None:
+            vector = self.store.get(key)
+            if vector is not None:
+                self.memory.set(key, vector)
+        if vector is None:
+            vector = self.embedder.embed_query(text)
+            self.memory.set(key, vector)
+            if self.store is not None:
+                self.store.set(key, vector)
+        return vector
+
+    def stats(self):
+        return {
+            "memory": self.memory.stats(),
+            **({"store": self.store.stats()} if self.store is not None else {})
+        }
+
+    def close(self):
+        self.embedder.close()
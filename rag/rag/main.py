@@ -1,3 +1,4 @@
+import os
 from dotenv import load_dotenv
 
 from auth import get_oauth_session
@@ -14,10 +15,16 @@ from utils import toJson
 from requests.exceptions import HTTPError
 
 from typing_extensions import Annotated
-from typer import Typer, Context, Option, Argument, echo, secho, colors
+from typer import Typer, Context, Option, Argument, Exit, BadParameter, echo, secho, colors
 
 from chatbot import run_chat
 from app import RagApp, put_tika
+from cache import make_cache
+from manifest import Manifest
+from embeddings import OllamaEmbedder, CachedEmbedder, schema_vectorizer
+from vector_replica import VectorReplica
+# stessa istanza usata da app e weaviate_client (importati come rag.*)
+from rag.metrics import metrics as run_metrics
 
 load_dotenv()
 
@@ -48,10 +55,12 @@ def apply_schema(ctx: Context, file_path: str):
     print("opening", file_path)
     with open(file_path, "r") as f:
         definitions = json.load(f)
-        created, skipped, failed = ctx.obj.app.get_weaviate_client().apply_schema(definitions)
+        created, skipped, failed, added = ctx.obj.app.get_weaviate_client().apply_schema(definitions)
 
     secho("Created:", fg=colors.GREEN)
     secho(toJson(created))
+    secho("Added properties:", fg=colors.GREEN)
+    secho(toJson(added))
     secho("Skipped:", fg=colors.YELLOW)
     secho(toJson(skipped))
     secho("Failed:", fg=colors.RED)
@@ -73,10 +82,52 @@ def delete_class(ctx: Context, class_name: Annotated[str, Argument(...)]):
     ctx.obj.app.get_weaviate_client().delete_class(class_name)
 
 @app.command()
-def ingest(ctx: Context, file_path: str, recursive: Annotated[bool, Option("--recursive", "-r", help="Recursive scan", show_default=True)] = False):
-    ctx.obj.app.ingest_path(file_path, recursive)
+def ingest(
+    ctx: Context,
+    file_path: str,
+    recursive: Annotated[bool, Option("--recursive", "-r", help="Recursive scan", show_default=True)] = False,
+    batch_size: Annotated[int, Option("--batch-size", "-b", help="Initial number of chunks per batch import", show_default=True)] = 100,
+    workers: Annotated[int, Option("--workers", "-w", help="Worker threads per pipeline stage (1 = sequential)", show_default=True)] = 1,
+    hash_workers: Annotated[int, Option("--hash-workers", help="Threads hashing files ahead of ingestion", show_default=True)] = 2,
+    dedup_batch_size: Annotated[int, Option("--dedup-batch-size", help="Files looked up and deduplicated together before ingestion", show_default=True)] = 1000,
+    stream: Annotated[bool, Option("--stream", help="Stream Tika output and chunks instead of loading whole documents", show_default=True)] = False,
+    document_text: Annotated[bool, Option("--document-text/--no-document-text", help="Store the full extracted text in Document", show_default=True)] = True,
+    client_embeddings: Annotated[bool, Option("--client-embeddings/--server-embeddings", help="Compute chunk vectors with Ollama before upload instead of in Weaviate", show_default=True)] = False,
+    embed_batch_size: Annotated[int, Option("--embed-batch-size", help="Chunks per Ollama embed call", show_default=True)] = 64,
+    embed_workers: Annotated[int, Option("--embed-workers", help="Concurrent Ollama embed calls", show_default=True)] = 2
+):
+    ctx.obj.app.batch_size = batch_size
+    ctx.obj.app.streaming = stream
+    ctx.obj.app.hash_workers = hash_workers
+    ctx.obj.app.dedup_batch_size = dedup_batch_size
+    ctx.obj.app.store_document_text = document_text
+    if client_embeddings:
+        if ctx.obj.app.embedder is None:
+            ctx.obj.app.embedder = make_embedder(ctx.obj.ollama_url, ctx.obj.embed_model)
+        ctx.obj.app.client_embeddings = True
+        ctx.obj.app.vectorize_class_name = schema_vectorizer(SCHEMA_PATH).get("vectorizeClassName", True)
+        ctx.obj.app.embed_batch_size = embed_batch_size
+        ctx.obj.app.embed_workers = embed_workers
+    failures = ctx.obj.app.ingest_path(file_path, recursive, workers)
+    if failures:
+        secho(f"{len(failures)} file falliti:", err=True, fg=colors.RED)
+        secho(toJson(failures), err=True)
     
 
+@app.command()
+def reconcile(
+    ctx: Context,
+    page_size: Annotated[int, Option("--page-size", help="Objects per GraphQL page", show_default=True)] = 1000
+):
+    """
+    Ricostruisce il manifest locale leggendo i documenti da Weaviate.
+    """
+    if ctx.obj.app.manifest is None:
+        secho("manifest non configurato: usare --manifest o RAG_MANIFEST", err=True, fg=colors.RED)
+        raise Exit(1)
+    n = ctx.obj.app.reconcile_manifest(page_size)
+    secho(f"manifest ricostruito: {n} documenti", fg=colors.GREEN)
+
 # @app.command()
 # def ingest_file(ctx: Context, file_path: Annotated[str, Argument(...)]):
 #     delete_chunks_by_source(ctx, file_path)
@@ -89,19 +140,42 @@ def ingest(ctx: Context, file_path: str, recursive: Annotated[bool, Option("--re
 #     echo(toJson(resp))
 
 @app.command()
-def show_documents(ctx: Context):
-    documents = ctx.obj.app.get_documents()
-    for document in documents:
-        secho(document["_additional"]["id"])
-        secho(document["source"])
-        secho(document["vectorized"])
+def sync_replica(
+    ctx: Context,
+    page_size: Annotated[int, Option("--page-size", help="Objects per page", show_default=True)] = 500
+):
+    """
+    Ricostruisce la replica locale dei vettori di DocumentChunk (richiede --replica).
+    """
+    if ctx.obj.app.replica is None:
+        secho("--replica non impostato", err=True, fg=colors.RED)
+        raise Exit(1)
+    count = ctx.obj.app.sync_replica(page_size)
+    secho(f"Replica aggiornata: {count} chunk", fg=colors.GREEN)
 
 @app.command()
-def show_chunks(ctx: Context):
-    chunks = ctx.obj.app.get_chunks()
-    for chunk in chunks:
-        secho(chunk["_additional"]["id"])
-        secho(chunk["source"])
+def show_documents(
+    ctx: Context,
+    with_text: Annotated[bool, Option("--with-text", help="Include the full extracted text of each document", show_default=True)] = False,
+    page_size: Annotated[int, Option("--page-size", help="Objects per GraphQL page (0 = 1000, or 20 with --with-text)", show_default=True)] = 0
+):
+    """
+    Stampa tutti i Document (id, source, vectorized e con --with-text il testo) come NDJSON (un oggetto JSON per riga).
+    """
+    page_size = page_size or (20 if with_text else 1000)
+    for document in ctx.obj.app.get_documents(page_size, with_text):
+        echo(json.dumps(document, ensure_ascii=False))
+
+@app.command()
+def show_chunks(
+    ctx: Context,
+    page_size: Annotated[int, Option("--page-size", help="Objects per GraphQL page", show_default=True)] = 1000
+):
+    """
+    Stampa tutti i DocumentChunk come NDJSON (un oggetto JSON per riga).
+    """
+    for chunk in ctx.obj.app.get_chunks(page_size):
+        echo(json.dumps(chunk, ensure_ascii=False))
 
 @app.command()
 def delete_chunks_by_source(ctx: Context, source: str):
@@ -124,22 +198,49 @@ def bm25(ctx: Context, class_name: str, text: str):
     print("DOCUMENTI TROVATI", len(result))
     echo(toJson(result))
 
+@app.command()
+def hybrid(
+    ctx: Context,
+    text: Annotated[str, Argument(..., help="The query text")],
+    alpha: Annotated[float, Option("--alpha", "-a", help="Peso della ricerca vettoriale (0 = solo bm25, 1 = solo vettori)", show_default=True)] = 0.5,
+    fusion_type: Annotated[str, Option("--fusion-type", help="rankedFusion o relativeScoreFusion", show_default=True)] = "relativeScoreFusion",
+    k: Annotated[int, Option("--k", "-k", help="Number of top results", show_default=True)] = 3,
+    neighbors: Annotated[int, Option("--neighbors", "-n", help="Number of neighbor chunks to include", show_default=True)] = 0,
+    rerank: Annotated[bool, Option("--rerank/--no-rerank", help="Riordina i candidati con il modulo reranker-transformers", show_default=True)] = False
+):
+    if fusion_type not in ("rankedFusion", "relativeScoreFusion"):
+        raise BadParameter("usare rankedFusion o relativeScoreFusion", param_hint="--fusion-type")
+    result = ctx.obj.app.hybrid(text, alpha, fusion_type, k, neighbors, rerank)
+    echo(toJson(result))
+
 @app.command()
 def chat(
     ctx: Context,
     groq_api_key: Annotated[str, Option("--groq-api-key", "-g",help="API Key per Groq Chat",envvar="GROQ_API_KEY")],
     k: Annotated[int, Option("--k", "-k", help="Top-k chunks", show_default=True)] = 3,
-    neighbors: Annotated[int, Option("--neighbors", "-n", help="Vicini da includere", show_default=True)] = 1
+    neighbors: Annotated[int, Option("--neighbors", "-n", help="Vicini da includere", show_default=True)] = 1,
+    search: Annotated[str, Option("--search", help="Ricerca dei chunk: nearText o hybrid", show_default=True)] = "nearText",
+    alpha: Annotated[float, Option("--alpha", "-a", help="Peso vettoriale della ricerca hybrid", show_default=True)] = 0.5,
+    stream: Annotated[bool, Option("--stream/--no-stream", help="Stampa la risposta token per token", show_default=True)] = False,
+    memory_tokens: Annotated[int, Option("--memory-tokens", help="Budget di token della storia: oltre, i turni più vecchi vengono riassunti (0 = storia completa)", show_default=True)] = 0,
+    context_tokens: Annotated[int, Option("--context-tokens", help="Budget di token del contesto documentale per risposta", show_default=True)] = 3000
 ):
     """
     Avvia la chat RAG interattiva usando GroqChat + Weaviate.
     """
-    client = ctx.obj.weaviate_client
+    if search not in ("nearText", "hybrid"):
+        raise BadParameter("usare nearText o hybrid", param_hint="--search")
+    client = ctx.obj.app.get_weaviate_client()
     run_chat(
         client=client,
         groq_api_key=groq_api_key,
         k=k,
-        neighbors=neighbors
+        neighbors=neighbors,
+        search=search,
+        alpha=alpha,
+        stream=stream,
+        memory_tokens=memory_tokens,
+        context_tokens=context_tokens
     )
 
 @app.command()
@@ -232,14 +333,86 @@ def test(
     #     }, properties=["size", "source","m_time"],additional=["id","score"]))
     
 
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.json")
+
+def make_embedder(ollama_url: str, embed_model: str) -> OllamaEmbedder:
+    # stessi endpoint e modello del vectorizer di DocumentChunk, salvo override da CLI/env
+    vectorizer = schema_vectorizer(SCHEMA_PATH)
+    return OllamaEmbedder(ollama_url or vectorizer["apiEndpoint"], embed_model or vectorizer["model"])
+
 @app.callback()
 def main(
     ctx: Context,
     weaviate_url:     Annotated[str, Option(..., envvar="WEAVIATE_URL", help="URL of the Weaviate instance")],
-    weaviate_api_key: Annotated[str, Option(..., envvar="WEAVIATE_API_KEY", help="Weaviate bearer api key")]
+    weaviate_api_key: Annotated[str, Option(..., envvar="WEAVIATE_API_KEY", help="Weaviate bearer api key")],
+    pool_size:        Annotated[int, Option("--pool-size", envvar="WEAVIATE_POOL_SIZE", help="Max pooled HTTP connections to Weaviate", show_default=True)] = 10,
+    keep_alive:       Annotated[bool, Option("--keep-alive/--no-keep-alive", help="Reuse HTTP connections to Weaviate", show_default=True)] = True,
+    connect_timeout:  Annotated[float, Option("--connect-timeout", envvar="WEAVIATE_CONNECT_TIMEOUT", help="Connect timeout in seconds", show_default=True)] = 5.0,
+    read_timeout:     Annotated[float, Option("--read-timeout", envvar="WEAVIATE_READ_TIMEOUT", help="Read timeout in seconds", show_default=True)] = 60.0,
+    http2:            Annotated[bool, Option("--http2", help="Use HTTP/2 (requires httpx[http2])", show_default=True)] = False,
+    cache:            Annotated[str, Option("--cache", envvar="RAG_CACHE", help="Query result cache: none, memory or sqlite", show_default=True)] = "none",
+    cache_ttl:        Annotated[float, Option("--cache-ttl", envvar="RAG_CACHE_TTL", help="Cache entries time to live in seconds", show_default=True)] = 300,
+    cache_size:       Annotated[int, Option("--cache-size", help="Max cached queries", show_default=True)] = 1000,
+    cache_path:       Annotated[str, Option("--cache-path", envvar="RAG_CACHE_PATH", help="SQLite cache file", show_default=True)] = "query_cache.sqlite",
+    manifest:         Annotated[str, Option("--manifest", envvar="RAG_MANIFEST", help="Local SQLite manifest of ingested files (disabled if empty)")] = "",
+    stats:            Annotated[bool, Option("--stats", help="Print connection and cache statistics at exit", show_default=True)] = False,
+    replica:          Annotated[str, Option("--replica", envvar="RAG_REPLICA", help="Local vector replica of DocumentChunk (path prefix, disabled if empty)")] = "",
+    offline:          Annotated[bool, Option("--offline", help="Answer searches only from the local replica, never from Weaviate", show_default=True)] = False,
+    ollama_url:       Annotated[str, Option("--ollama-url", envvar="OLLAMA_URL", help="Ollama endpoint for client-side embeddings (default: schema.json)")] = "",
+    embed_model:      Annotated[str, Option("--embed-model", envvar="OLLAMA_EMBED_MODEL", help="Embedding model (default: schema.json)")] = "",
+    embed_queries:    Annotated[bool, Option("--embed-queries", help="Embed queries client-side (cached) and search with nearVector", show_default=True)] = False,
+    embed_cache_size: Annotated[int, Option("--embed-cache-size", help="Query embeddings kept in memory", show_default=True)] = 1024,
+    embed_cache_path: Annotated[str, Option("--embed-cache-path", envvar="RAG_EMBED_CACHE_PATH", help="SQLite store of query embeddings (memory only if empty)")] = "",
+    metrics:          Annotated[bool, Option("--metrics", help="Print a per-stage timing breakdown at exit", show_default=True)] = False,
+    metrics_format:   Annotated[str, Option("--metrics-format", help="Metrics format: text, json or prometheus", show_default=True)] = "text",
+    metrics_output:   Annotated[str, Option("--metrics-output", help="Write metrics to this file instead of stderr")] = ""
 ):
+    if metrics_format not in ("text", "json", "prometheus"):
+        raise BadParameter("usare text, json o prometheus", param_hint="--metrics-format")
+
     ctx.obj = SimpleNamespace()
-    ctx.obj.app = RagApp(weaviate_url, weaviate_api_key)
+    ctx.obj.app = RagApp(
+        weaviate_url,
+        weaviate_api_key,
+        pool_size=pool_size,
+        keep_alive=keep_alive,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        http2=http2,
+        cache=make_cache(cache, cache_size, cache_ttl, cache_path)
+    )
+    if manifest:
+        ctx.obj.app.manifest = Manifest(manifest)
+    if replica:
+        ctx.obj.app.replica = VectorReplica(replica)
+    if replica or embed_queries:
+        ctx.obj.app.embedder = CachedEmbedder(make_embedder(ollama_url, embed_model), embed_cache_size, embed_cache_path or None)
+    ctx.obj.app.offline = offline
+    ctx.obj.ollama_url = ollama_url
+    ctx.obj.embed_model = embed_model
+
+    def on_close():
+        client = ctx.obj.app.get_weaviate_client()
+        if stats:
+            secho("Connection stats:", err=True, fg=colors.CYAN)
+            secho(toJson(client.connection_stats()), err=True)
+            if client.cache is not None:
+                secho("Cache stats:", err=True, fg=colors.CYAN)
+                secho(toJson(client.cache.stats()), err=True)
+            if ctx.obj.app.embedder is not None:
+                secho("Embedding cache stats:", err=True, fg=colors.CYAN)
+                secho(toJson(ctx.obj.app.embedder.stats()), err=True)
+        if metrics:
+            report = run_metrics.export(metrics_format)
+            if metrics_output:
+                with open(metrics_output, "w", encoding="utf-8") as f:
+                    f.write(report)
+            else:
+                secho("Metrics:", err=True, fg=colors.CYAN)
+                secho(report, err=True)
+        client.close()
+
+    ctx.call_on_close(on_close)
     
     #file_path = "/home/niko/Scaricati/PSN_UserGuide_IaaS_Industry_Standardv3.0.3.pdf"
 
@@ -0,0 +1,63 @@
+import sqlite3
+from threading import Lock
+
+class Manifest:
+    """
+    Indice locale (SQLite) dei file già ingestati: source -> (size, m_time, hash, doc_id, chunk_count).
+    Permette di saltare i file invariati con il solo stat(), senza interrogare Weaviate né rileggere il file.
+    """
+    def __init__(self, path: str = "manifest.sqlite"):
+        self.path = path
+        self.lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS manifest (
+                source TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                m_time TEXT NOT NULL,
+                hash TEXT,
+                doc_id TEXT,
+                chunk_count INTEGER
+            )
+        """)
+        self.db.commit()
+
+    def get(self, source: str):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT source, size, m_time, hash, doc_id, chunk_count FROM manifest WHERE source = ?",
+                (source,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("source", "size", "m_time", "hash", "doc_id", "chunk_count"), row))
+
+    def is_unchanged(self, source: str, size: int, m_time: str) -> bool:
+        entry = self.get(source)
+        return entry is not None and entry["size"] == size and entry["m_time"] == m_time
+
+    def put(self, source: str, size: int, m_time: str, hash: str, doc_id: str, chunk_count: int | None):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO manifest (source, size, m_time, hash, doc_id, chunk_count) VALUES (?, ?, ?, ?, ?, ?)",
+                (source, size, m_time, hash, doc_id, chunk_count)
+            )
+
+    def delete(self, source: str):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM manifest WHERE source = ?", (source,))
+
+    def replace_all(self, entries):
+        """
+        Sostituisce l'intero contenuto con entries (dict con le stesse chiavi di get).
+        """
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM manifest")
+            self.db.executemany(
+                "INSERT OR REPLACE INTO manifest (source, size, m_time, hash, doc_id, chunk_count) VALUES (:source, :size, :m_time, :hash, :doc_id, :chunk_count)",
+                entries
+            )
+
+    def count(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM manifest").fetchone()[0]
@@ -0,0 +1,114 @@
+import json
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+class Metrics:
+    """
+    Timer e contatori di processo, thread-safe, con etichette facoltative (es. endpoint="graphql").
+    Esportabili come JSON, nel formato testuale di Prometheus o come riepilogo per stadio.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.timers = {}
+        self.counters = {}
+
+    @staticmethod
+    def key(name: str, labels: dict):
+        return (name, tuple(sorted(labels.items())))
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                self.timers[key] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - began, **labels)
+
+    def inc(self, name: str, value: int = 1, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def reset(self):
+        with self.lock:
+            self.timers.clear()
+            self.counters.clear()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            timers = [
+                {"name": name, "labels": dict(labels), "count": count, "seconds": round(total, 6), "max_seconds": round(peak, 6)}
+                for (name, labels), (count, total, peak) in sorted(self.timers.items())
+            ]
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+        return {"timers": timers, "counters": counters}
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2, ensure_ascii=False)
+
+    def to_prometheus(self, prefix: str = "rag") -> str:
+        def labels_text(labels):
+            if not labels:
+                return ""
+            escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for v in labels.values())
+            return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels.keys(), escaped)) + "}"
+
+        snapshot = self.snapshot()
+        lines = []
+        for name in dict.fromkeys(t["name"] for t in snapshot["timers"]):
+            metric = f"{prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for t in (t for t in snapshot["timers"] if t["name"] == name):
+                lines.append(f"{metric}_count{labels_text(t['labels'])} {t['count']}")
+                lines.append(f"{metric}_sum{labels_text(t['labels'])} {t['seconds']}")
+            lines.append(f"# TYPE {metric}_max gauge")
+            for t in (t for t in snapshot["timers"] if t["name"] == name):
+                lines.append(f"{metric}_max{labels_text(t['labels'])} {t['max_seconds']}")
+        for name in dict.fromkeys(c["name"] for c in snapshot["counters"]):
+            metric = f"{prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for c in (c for c in snapshot["counters"] if c["name"] == name):
+                lines.append(f"{metric}{labels_text(c['labels'])} {c['value']}")
+        return "\n".join(lines) + "\n"
+
+    def to_text(self) -> str:
+        """
+        Riepilogo leggibile: un rigo per timer (chiamate, tempo totale, medio e massimo) e uno per contatore.
+        I tempi degli stadi eseguiti in parallelo si sommano, quindi il totale può superare la durata dell'esecuzione.
+        """
+        snapshot = self.snapshot()
+        lines = [f"{'stage':<40} {'calls':>8} {'total s':>10} {'mean ms':>10} {'max ms':>10}"]
+        for t in sorted(snapshot["timers"], key=lambda t: -t["seconds"]):
+            name = t["name"] + "".join(f" {k}={v}" for k, v in t["labels"].items())
+            lines.append(f"{name:<40} {t['count']:>8} {t['seconds']:>10.3f} {t['seconds'] / t['count'] * 1000:>10.1f} {t['max_seconds'] * 1000:>10.1f}")
+        for c in snapshot["counters"]:
+            name = c["name"] + "".join(f" {k}={v}" for k, v in c["labels"].items())
+            lines.append(f"{name:<40} {c['value']:>8}")
+        return "\n".join(lines)
+
+    def export(self, format: str = "text") -> str:
+        if format == "json":
+            return self.to_json()
+        if format == "prometheus":
+            return self.to_prometheus()
+        if format == "text":
+            return self.to_text()
+        raise ValueError(f"Formato di metriche '{format}' non supportato (text, json, prometheus)")
+
+# istanza di processo usata da RagApp, WeaviateClient e dalla CLI
+metrics = Metrics()
@@ -2,144 +2,46 @@
 title: Weaviate Search
 author: Nicola Ranaldo
 description: Tool per eseguire una ricerca semantica di concetti e/o domande su un server Weaviate
-requirements: graphql-query, requests, pydantic
+requirements: graphql-query, httpx, pydantic
 version: 0.1.0
 """
 
-import requests
+import httpx
 import json
 from pydantic import BaseModel, Field, SecretStr
 from graphql_query import Operation, Query, Field as GField, Argument, Variable
 from typing import Dict, List
-from requests.exceptions import HTTPError
-from urllib.parse import urlencode
 
-class WeaviateClient:
-    def __init__(self, url, weaviate_api_key):
+class AsyncWeaviateClient:
+    """
+    Client asyncio minimale per Weaviate: le chiamate non bloccano l'event loop di Open WebUI
+    e riusano le connessioni del pool httpx tra una ricerca e l'altra.
+    """
+    def __init__(self, url, weaviate_api_key, pool_size: int = 10, timeout: float = 60.0):
         self.url = url.rstrip('/')+'/'
         self.headers = {
             "Content-Type": "application/json",
             **({"Authorization": "Bearer " + weaviate_api_key} if weaviate_api_key else {})
         }
+        self.session = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(timeout, connect=5.0)
+        )
 
-    def api_build_url(self, name, additional=None, version="v1", params = None):
+    async def api_post(self, name, body, additional="", version="v1"):
         url = self.url+version+'/'+name
         if additional:
             url += "/" + additional
-        if params:
-            query_string = urlencode(params)
-            url += '?' + query_string
-        return url
-
-    def api_get(self, name, additional="", version="v1"):
-        url = self.api_build_url(name, additional, version)
-        resp = requests.get(url, headers=self.headers)
-        resp.raise_for_status()
-        return resp.json()
-
-    def api_post(self, name, body, additional="", version="v1"):
-        url = self.api_build_url(name, additional, version)
-        resp = requests.post(url, json=body, headers=self.headers)
-        resp.raise_for_status()
-        return resp.json()
-
-    def api_put(self, name, body, additional="", version="v1"):
-        url = self.api_build_url(name, additional, version)
-        resp = requests.put(url, json=body, headers=self.headers)
-        resp.raise_for_status()
-        return resp.json()
-
-    def api_delete(self, name, additional="", version="v1"):
-        url = self.api_build_url(name, additional, version)
-        resp = requests.delete(url, headers=self.headers)
-        resp.raise_for_status()
-        return
-    
-    def api_patch(self, name, body, additional="", version="v1", params = None):
-        url = self.api_build_url(name, additional, version, params)
-        resp = requests.patch(url, json=body, headers = self.headers)
-        resp.raise_for_status()
-        return resp
-
-    def api_delete_with_json(self, name, additional="", body=None, version="v1"):
-        url = self.api_build_url(name, additional, version)
-        resp = requests.delete(url, json=body, headers=self.headers)
+        resp = await self.session.post(url, json=body, headers=self.headers)
         resp.raise_for_status()
         return resp.json()
 
-    def get_schema(self):
-        return self.api_get("schema")
-
-    def get_class(self, class_name):
-        return self.api_get("schema", class_name)
-
-    def create_class(self, definition):
-        return self.api_post( "schema", definition)
-
-    def delete_class(self, class_name):
-        return self.api_delete("schema", class_name)
-    
-    def apply_schema(self, definitions: Dict[str, object]) -> Dict[str, object]:
-        
-        created_results: Dict[str, object] = {}
-        skipped_class: list[str] = []
-        failed_class: list[str] = []
-
-        for class_name, definition in definitions.items():
-            try:
-                self.get_class(class_name)
-                skipped_class.append(class_name)
-            
-            except HTTPError as e:
-                if e.response.status_code != 404:
-                    raise
-                else:
-                    try:
-                        created = self.create_class(definition)
-                        created_results[class_name] = created
-                    except HTTPError as e:
-                        print(e)
-                        failed_class.append(class_name)
-
-        return (created_results, skipped_class, failed_class)    
-
-    def ingest(self, class_name, **kwargs):
-        payload = {
-            "class": class_name,
-            "properties": kwargs
-        }
-        return self.api_post("objects", payload)    
-
-    def get_objects(self, class_name: str, fields = []):
-        fields.append(Field(name="_additional", fields=["id"]))
-        op = Operation(
-            type="query",
-            queries=[
-                Query(
-                    name="Get",
-                    fields=[
-                        GField(
-                            name = class_name,
-                            fields=fields
-                        )
-                    ]
-                )
-            ]
-        )
-        graphql = op.render()
-        resp = self.api_post("graphql", {"query": graphql})
-        return resp
-
-    def patch_object(self, class_name, id, body):
-        return self.api_patch("objects", body, additional = class_name + '/' +  id)
-
-    def super_search(self, class_name: str, variables: Dict, properties: List = [], additional : List = [], neighbors = 0, neighbors_index_name="chunk_id", key_property_name="source"):
+    async def super_search(self, class_name: str, variables: Dict, properties: List = [], additional : List = [], neighbors = 0, neighbors_index_name="chunk_id", key_property_name="source"):
 
         TYPE_MAP = {
             "where": "GetObjects"+class_name+"WhereInpObj!",
             "bm25": "GetObjects"+class_name+"HybridGetBm25InpObj!",
             "nearText": "GetObjects"+class_name+"NearTextInpObj!",
-            #"limit": "Int!" ERRORE GRAVOTTO
         }
 
         variable_objs = {
@@ -148,8 +50,6 @@ class WeaviateClient:
             if name in TYPE_MAP
         }
 
-        variable_definitions = list(variable_objs.values())
-
         arguments = [
             Argument(name=name, value=variable_objs[name])
             for name in variable_objs
@@ -158,74 +58,58 @@ class WeaviateClient:
         if "limit" in variables:
             arguments.append(Argument(name="limit", value=variables["limit"]))
 
-        fields = properties
+        fields = list(properties)
         if (additional):
-            additional_field = GField(name="_additional", fields=additional)
-            fields.append(additional_field)
-
-        query = Query(
-            name="Get",
-            fields=[
-                GField(
-                    name=class_name,
-                    arguments=arguments,
-                    fields=fields
-                )
-            ]
-        )
+            fields.append(GField(name="_additional", fields=additional))
+
         operation = Operation(
-            queries=[query],
-            variables=variable_definitions
+            queries=[Query(name="Get", fields=[GField(name=class_name, arguments=arguments, fields=fields)])],
+            variables=list(variable_objs.values())
         )
 
-        q = operation.render()
-
-        print("QUERY",q, variables)
-
-        resp = self.api_post("graphql", {
-            "query": q,
+        resp = await self.api_post("graphql", {
+            "query": operation.render(),
             "variables": variables
         })
 
+        if "errors" in resp:
+            raise(ValueError(resp))
+
         objects=resp['data']['Get'][class_name]
 
         if neighbors > 0 and objects:
-            # 1) costruisco (chunk_id, source) dei vicini
-            neighbor_pairs = set()
+            # finestre [chunk_id - n, chunk_id + n] per source, fuse se contigue: un operando per finestra
+            ranges = {}
             for o in objects:
                 cid = o[neighbors_index_name]
-                src = o[key_property_name]
-                for delta in range(1, neighbors+1):
-                    if cid - delta >= 0:
-                        neighbor_pairs.add((cid - delta, src))
-                    neighbor_pairs.add((cid + delta, src))
-
-            # 2) filtro GraphQL OR-of-ANDs
-            where_filter = {
-                "operator": "Or",
-                "operands": [
-                    {
-                        "operator": "And",
-                        "operands": [
-                            {"path": [neighbors_index_name],
-                             "operator": "Equal",
-                             "valueInt": neigh_cid},
-                            {"path": [key_property_name],
-                             "operator": "Equal",
-                             "valueString": neigh_src}
-                        ]
-                    }
-                    for neigh_cid, neigh_src in neighbor_pairs
-                ]
-            }
+                ranges.setdefault(o[key_property_name], []).append((max(0, cid - neighbors), cid + neighbors))
+
+            windows = []
+            for src, intervals in ranges.items():
+                merged = []
+                for first, last in sorted(intervals):
+                    if merged and first <= merged[-1][1] + 1:
+                        merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+                    else:
+                        merged.append((first, last))
+                windows.extend((src, first, last) for first, last in merged)
+
+            operands = [
+                {
+                    "operator": "And",
+                    "operands": [
+                        {"path": [key_property_name], "operator": "Equal", "valueString": src},
+                        {"path": [neighbors_index_name], "operator": "GreaterThanEqual", "valueInt": first},
+                        {"path": [neighbors_index_name], "operator": "LessThanEqual", "valueInt": last}
+                    ]
+                }
+                for src, first, last in windows
+            ]
+            where_filter = operands[0] if len(operands) == 1 else {"operator": "Or", "operands": operands}
 
-            # 3) richiamo super_search per i soli neighbor, disabilitando la ricorsione
-            neighbor_objs = self.super_search(
+            neighbor_objs = await self.super_search(
                 class_name,
-                variables={
-                    "where": where_filter,
-                    #"limit": len(neighbor_pairs),
-                },
+                variables={"where": where_filter, "limit": sum(last - first + 1 for _, first, last in windows)},
                 properties=properties,
                 additional=additional,
                 neighbors=0,
@@ -233,182 +117,70 @@ class WeaviateClient:
                 key_property_name=key_property_name
             )
 
-            # 4) unisco e ordino
-            objects.extend(neighbor_objs)
+            seen = {(o[key_property_name], o[neighbors_index_name]) for o in objects}
+            objects.extend(o for o in neighbor_objs if (o[key_property_name], o[neighbors_index_name]) not in seen)
 
         if objects and neighbors_index_name in objects[0]:
             return sorted(objects, key=lambda x: x[neighbors_index_name])
         
         return objects
-                        
-    def delete_objects(self, class_name: str, where: Dict):
-        payload = {
-            "match": {
-              "class": class_name,
-              "where": where
-            },
-            "output": "verbose",
-            "dryRun": False
-        }
 
-        resp = self.api_delete_with_json("batch", "objects", payload)
 
-        return resp
-
-    def delete_document_chunks_by_source(self, source: str):
-
-        payload = {
-            "match": {
-              "class": "DocumentChunk",
-              "where": {
-                "path": ["source"],
-                "operator": "Equal",
-                "valueString": source
-              }
-            },
-            "output": "verbose",
-            "dryRun": False
-        }
-
-        resp = self.api_delete_with_json("batch", "objects", payload)
-
-        return resp
-
-
-    def nearText(self, class_name: str, text: str, properties : list[str], additional: list[str], k: int = 1, neighbors: int = 1, neighbors_property_name: str = "chunk_id", same_property_name: str = "source"):
-
-        for a in ['certainty', 'distance', 'score']:
-            if not a in additional:
-                additional.append(a)
-
-        if (neighbors > 0):
-            if not neighbors_property_name in properties:
-                properties.append(neighbors_property_name)
-            if not "id" in additional:
-                additional.append("id")
-
-        objects = self.super_search(
-            class_name,
-            {
-                "nearText": {
-                    "concepts": [text],
-                },
-                "limit": k
-            },
-            properties=properties,
-            additional=additional,
-            neighbors=neighbors,
-            neighbors_index_name=neighbors_property_name,
-            key_property_name=same_property_name
-        )
-
-        return objects
-        
-
-    def ask(self,
-            question: str,
-            properties: list[str] | None = None,
-            limit: int = 1,
-            certainty: float | None = None
-        ):
-        """
-        Esegue una query 'ask' su Weaviate utilizzando il modulo qna-openai.
-        Restituisce la risposta estratta con campo 'result'.
-        """
-        args = [
-            Argument(name="question", value=question)
-        ]
-        if properties:
-            args.append(Argument(name="properties", value=properties))
-        if certainty is not None:
-            args.append(Argument(name="certainty", value=certainty))
-
-        ask_arg = Argument(name="ask", value=args)
-        limit_arg = Argument(name="limit", value=limit)
-
-        ask_field = GField(
-            name="DocumentChunk",
-            arguments=[ask_arg, limit_arg],
-            fields=[
-                GField(
-                    name="_additional",
-                    fields=[
-                        GField(name="answer", fields=[
-                            "hasAnswer", "result", "certainty", "startPosition", "endPosition"
-                        ])
-                    ]
-                )
-            ]
-        )
-
-        op = Operation(
-            type="query",
-            queries=[Query(name="Get", fields=[ask_field])]
-        )
-        gql = op.render()
-        resp = self.api_post("graphql", {"query": gql})
-        return resp.get("data", {}).get("Get", {}).get("DocumentChunk", [])
-
-    def generate(self,
-                query: str,
-                prompt: str,
-                k: int = 1,
-                alpha: float | None = None
-        ):
-        """
-        Esegue una query 'generate' (RAG) su Weaviate utilizzando il modulo generative-openai.
-        - query: la stringa di ricerca (semantica/ibrida)
-        - prompt: template con placeholder {text} o altri campi
-        - k: numero di documenti da recuperare
-        - alpha: ponderazione per hybrid search (0-1)
-
-        Restituisce i testi generati per ogni risultato.
-        """
-        # filtro di retrieval (vettoriale/ibrido)
-        if alpha is not None:
-            filter_arg = Argument(
-                name="hybrid",
-                value=[
-                    Argument(name="query", value=query),
-                    Argument(name="alpha", value=alpha)
-                ]
-            )
-        else:
-            filter_arg = Argument(
-                name="nearText",
-                value=[Argument(name="concepts", value=[query])]
-            )
-        limit_arg = Argument(name="limit", value=k)
-
-        generate_args = [
-            Argument(
-                name="singleResult",
-                value=[Argument(name="prompt", value=prompt)]
-            )
-        ]
-        generate_field = Gield(
-            name="generate",
-            arguments=generate_args,
-            fields=["singleResult", "error"]
-        )
-
-        rag_field = Field(
-            name="DocumentChunk",
-            arguments=[filter_arg, limit_arg],
-            fields=[
-                Gield(name="chunk_id"),
-                Gield(name="text"),
-                Gield(name="_additional", fields=[generate_field])
-            ]
-        )
-
-        op = Operation(
-            type="query",
-            queries=[Query(name="Get", fields=[rag_field])]
-        )
-        gql = op.render()
-        resp = self.api_post("graphql", {"query": gql})
-        return resp.get("data", {}).get("Get", {}).get("DocumentChunk", [])
+# Copia di rag/context.py: il tool viene caricato in Open WebUI come file singolo
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def strip_overlap(previous: str, text: str, max_overlap: int = 400, min_overlap: int = 20) -> str:
+    for size in range(min(max_overlap, len(previous), len(text)), min_overlap - 1, -1):
+        if previous.endswith(text[:size]):
+            return text[size:]
+    return text
+
+def object_score(o: Dict) -> float:
+    additional = o.get("_additional") or {}
+    if additional.get("certainty") is not None:
+        return float(additional["certainty"])
+    if additional.get("distance") is not None:
+        return 1.0 - float(additional["distance"])
+    if additional.get("score") is not None:
+        return float(additional["score"])
+    return 0.0
+
+def pack_context(objects: List[Dict], token_budget: int = 3000, neighbors_index_name: str = "chunk_id", key_property_name: str = "source") -> List[Dict]:
+    """
+    Raggruppa i chunk per source, fonde i chunk_id contigui togliendo la sovrapposizione dello splitter
+    e tiene i passaggi migliori finché stanno in token_budget.
+    """
+    by_source = {}
+    for o in objects:
+        by_source.setdefault(o[key_property_name], {}).setdefault(o[neighbors_index_name], o)
+
+    runs = []
+    for source, chunks in by_source.items():
+        run = None
+        for cid in sorted(chunks):
+            o = chunks[cid]
+            if run is not None and cid == run["last"] + 1:
+                run["text"] += strip_overlap(run["text"], o.get("text") or "")
+                run["last"] = cid
+                run["score"] = max(run["score"], object_score(o))
+            else:
+                run = {"source": source, "first": cid, "last": cid, "text": o.get("text") or "", "score": object_score(o)}
+                runs.append(run)
+
+    packed = []
+    remaining = token_budget
+    for run in sorted(runs, key=lambda r: r["score"], reverse=True):
+        if remaining <= 0:
+            break
+        tokens = estimate_tokens(run["text"])
+        if tokens > remaining:
+            run["text"] = run["text"][:remaining * 4]
+            tokens = remaining
+        packed.append(run)
+        remaining -= tokens
+    return sorted(packed, key=lambda r: (r["source"], r["first"]))
 
 
 class Tools:
@@ -429,6 +201,10 @@ class Tools:
             0,
             description = "Number of neighbours chunks to retreieve first and after"
         )
+        CONTEXT_TOKENS: int = Field(
+            3000,
+            description = "Token budget of the merged passages returned to the model"
+        )
 
     class UserValves(BaseModel):
         pass
@@ -441,7 +217,7 @@ class Tools:
 
     def _ensure_waviate_client(self):
         if not self.weaviate_client:
-            self.weaviate_client = WeaviateClient(self.valves.WEAVIATE_URL, self.valves.WEAVIATE_API_KEY)
+            self.weaviate_client = AsyncWeaviateClient(self.valves.WEAVIATE_URL, self.valves.WEAVIATE_API_KEY)
         return self.weaviate_client
 
     
@@ -464,23 +240,24 @@ class Tools:
         properties = ["text", "source", "chunk_id"]
 
         try:
-            objects = self.weaviate_client.super_search(
+            objects = await self.weaviate_client.super_search(
                 "DocumentChunk",
                 {"nearText": {"concepts": [text]}, "limit": self.valves.WEAVIATE_K},
                 properties=properties,
                 additional=additional,
                 neighbors=self.valves.neighbours
             )
+            passages = pack_context(objects, self.valves.CONTEXT_TOKENS)
             await emitter(
                 {
                     "type": "status",
                     "data": {
-                        "description": f"Trovati {len(objects)} oggetti",
+                        "description": f"Trovati {len(objects)} oggetti ({len(passages)} passaggi)",
                         "done": True,
                     },
                 }
             )
-            pretty = json.dumps({"results": objects}, indent=2, ensure_ascii=False)
+            pretty = json.dumps({"results": passages}, indent=2, ensure_ascii=False)
             await emitter(
                 {"type": "message", "data": {"content": f"```json\n{pretty}\n```"}}
             )
@@ -488,7 +265,7 @@ class Tools:
                 {"type": "message", "data": {"content": "Ricerca completata"}}
             )
 
-            return {"results": objects}
+            return {"results": passages}
         except Exception as e:
             await emitter({"type": "error", "data": {"description": str(e)}})
             raise
@@ -0,0 +1,61 @@
+from queue import Queue
+from threading import Thread, Lock
+
+STOP = object()
+
+class StagePipeline:
+    """
+    Pipeline a stadi su thread: ogni stadio ha il suo gruppo di worker e legge da una coda limitata,
+    così uno stadio lento rallenta quelli a monte invece di accumulare elementi in memoria.
+    stages è una lista di (nome, funzione): la funzione riceve l'elemento spacchettato e restituisce
+    l'elemento per lo stadio successivo, oppure None per scartarlo.
+    Un'eccezione su un elemento viene registrata in failures e non interrompe la pipeline.
+    """
+    def __init__(self, stages, workers: int = 4, queue_size: int | None = None):
+        self.stages = stages
+        self.workers = workers
+        self.queue_size = queue_size or workers * 2
+        self.failures = []
+        self.lock = Lock()
+
+    def worker(self, name, func, in_queue, out_queue):
+        while True:
+            item = in_queue.get()
+            if item is STOP:
+                return
+            try:
+                result = func(*item)
+            except Exception as e:
+                print("***", name, "failed for", item[0], ":", repr(e))
+                with self.lock:
+                    self.failures.append({"item": item[0], "stage": name, "error": repr(e)})
+                continue
+            if result is not None and out_queue is not None:
+                out_queue.put(result)
+
+    def run(self, items):
+        queues = [Queue(maxsize=self.queue_size) for _ in self.stages]
+        stage_threads = []
+
+        for i, (name, func) in enumerate(self.stages):
+            out_queue = queues[i + 1] if i + 1 < len(queues) else None
+            threads = [
+                Thread(target=self.worker, args=(name, func, queues[i], out_queue), name=f"{name}-{n}", daemon=True)
+                for n in range(self.workers)
+            ]
+            for t in threads:
+                t.start()
+            stage_threads.append(threads)
+
+        # lo stadio di discovery gira nel thread chiamante
+        for item in items:
+            queues[0].put(item)
+
+        # chiusura ordinata: uno stadio termina solo dopo che quello a monte ha svuotato la sua coda
+        for queue, threads in zip(queues, stage_threads):
+            for _ in threads:
+                queue.put(STOP)
+            for t in threads:
+                t.join()
+
+        return self.failures
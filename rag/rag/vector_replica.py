@@ -0,0 +1,193 @@
+import os
+import sqlite3
+import numpy as np
+
+from threading import Lock
+from typing import List, Dict
+from rag.weaviate_client import neighbor_windows, merge_neighbors, sort_by_index
+
+try:
+    import hnswlib
+except ImportError:  # facoltativo: senza, la ricerca è sempre esatta (prodotto matrice-vettore)
+    hnswlib = None
+
+PROPERTIES = ["source", "chunk_id", "m_time", "text"]
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class VectorReplica:
+    """
+    Copia locale, in sola lettura, dei vettori di una classe Weaviate (DocumentChunk): una matrice float32
+    su file (path.f32, letta con memmap) e una tabella SQLite (path.sqlite) con le property, riga per riga.
+    I vettori sono salvati normalizzati, quindi la similarità coseno (la distanza di default di Weaviate)
+    è un semplice prodotto matrice-vettore. Oltre hnsw_threshold righe, se hnswlib è installato,
+    le ricerche passano da un indice HNSW (path.hnsw) costruito durante sync.
+    """
+    def __init__(self, path: str = "replica", hnsw_threshold: int = 200000):
+        self.path = path
+        self.hnsw_threshold = hnsw_threshold
+        self.lock = Lock()
+        self.db = sqlite3.connect(path + ".sqlite", check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL,
+                source TEXT,
+                chunk_id INTEGER,
+                m_time TEXT,
+                text TEXT
+            );
+            CREATE INDEX IF NOT EXISTS chunks_source ON chunks(source, chunk_id);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self.vectors = None
+        self.index = None
+        self.load()
+
+    def meta(self, key: str):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def load(self):
+        dim = self.meta("dim")
+        count = self.count()
+        if not dim or not count or not os.path.exists(self.path + ".f32"):
+            self.vectors = None
+            self.index = None
+            return
+        self.vectors = np.memmap(self.path + ".f32", dtype=np.float32, mode="r", shape=(count, int(dim)))
+        self.index = None
+        if hnswlib is not None and os.path.exists(self.path + ".hnsw"):
+            self.index = hnswlib.Index(space="ip", dim=int(dim))
+            self.index.load_index(self.path + ".hnsw", max_elements=count)
+
+    def count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def ready(self) -> bool:
+        return self.vectors is not None
+
+    def sync(self, client, class_name: str = "DocumentChunk", page_size: int = 500) -> int:
+        """
+        Ricostruisce la replica scorrendo class_name con il cursore after e _additional { vector }.
+        Scrive su file temporanei e li sostituisce solo alla fine: le ricerche in corso vedono la replica precedente.
+        Gli oggetti senza vettore (non ancora vettorizzati) vengono saltati. Restituisce il numero di righe.
+        """
+        vectors_tmp = self.path + ".f32.tmp"
+        db_tmp = self.path + ".sqlite.tmp"
+        if os.path.exists(db_tmp):
+            os.remove(db_tmp)
+
+        tmp = sqlite3.connect(db_tmp)
+        tmp.executescript("""
+            CREATE TABLE chunks (row INTEGER PRIMARY KEY, id TEXT NOT NULL, source TEXT, chunk_id INTEGER, m_time TEXT, text TEXT);
+            CREATE INDEX chunks_source ON chunks(source, chunk_id);
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+
+        dim = None
+        rows = []
+        count = 0
+        with open(vectors_tmp, "wb") as f:
+            for o in client.iter_objects(class_name, PROPERTIES, page_size, additional=["vector"]):
+                vector = o["_additional"].get("vector")
+                if not vector:
+                    continue
+                if dim is None:
+                    dim = len(vector)
+                normalize(np.asarray(vector, dtype=np.float32)).tofile(f)
+                rows.append((count, o["_additional"]["id"], o.get("source"), o.get("chunk_id"), o.get("m_time"), o.get("text")))
+                count += 1
+                if len(rows) >= page_size:
+                    tmp.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?)", rows)
+                    rows = []
+        tmp.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?)", rows)
+        tmp.executemany("INSERT INTO meta VALUES (?, ?)", [("dim", str(dim or 0)), ("class_name", class_name)])
+        tmp.commit()
+        tmp.close()
+
+        if dim and hnswlib is not None and count >= self.hnsw_threshold:
+            index = hnswlib.Index(space="ip", dim=dim)
+            index.init_index(max_elements=count, ef_construction=200, M=16)
+            index.add_items(np.memmap(vectors_tmp, dtype=np.float32, mode="r", shape=(count, dim)), np.arange(count))
+            index.save_index(self.path + ".hnsw")
+        elif os.path.exists(self.path + ".hnsw"):
+            os.remove(self.path + ".hnsw")
+
+        with self.lock:
+            self.db.close()
+            self.vectors = None
+            os.replace(vectors_tmp, self.path + ".f32")
+            os.replace(db_tmp, self.path + ".sqlite")
+            self.db = sqlite3.connect(self.path + ".sqlite", check_same_thread=False)
+            self.load()
+        return count
+
+    def rows(self, row_ids: List[int]) -> Dict[int, Dict]:
+        placeholders = ",".join("?" * len(row_ids))
+        found = self.db.execute(
+            f"SELECT row, id, source, chunk_id, m_time, text FROM chunks WHERE row IN ({placeholders})",
+            [int(r) for r in row_ids]
+        ).fetchall()
+        return {
+            row: {"source": source, "chunk_id": chunk_id, "m_time": m_time, "text": text, "_additional": {"id": id}}
+            for row, id, source, chunk_id, m_time, text in found
+        }
+
+    def top_k(self, vector: List[float], k: int):
+        query = normalize(np.asarray(vector, dtype=np.float32))
+        if self.index is not None:
+            self.index.set_ef(max(50, k * 4))
+            labels, distances = self.index.knn_query(query, k=min(k, len(self.vectors)))
+            return list(labels[0]), [1.0 - d for d in distances[0]]
+
+        scores = self.vectors @ query
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return list(best), [float(scores[i]) for i in best]
+
+    def near_vector(self, vector: List[float], k: int = 3, neighbors: int = 0, neighbors_index_name: str = "chunk_id", key_property_name: str = "source") -> List[Dict]:
+        """
+        Come WeaviateClient.nearText, ma sulla replica: restituisce oggetti nella stessa forma,
+        con certainty e distance coseno in _additional.
+        """
+        with self.lock:
+            if not self.ready():
+                raise LookupError(f"replica {self.path} vuota: eseguire sync-replica")
+            row_ids, scores = self.top_k(vector, k)
+            found = self.rows(row_ids)
+
+        objects = []
+        for row, score in zip(row_ids, scores):
+            o = found[int(row)]
+            o["_additional"].update({"distance": 1.0 - score, "certainty": (1.0 + score) / 2})
+            objects.append(o)
+
+        if neighbors > 0 and objects:
+            objects = merge_neighbors(objects, self.window_objects(neighbor_windows(objects, neighbors, neighbors_index_name, key_property_name)), neighbors_index_name, key_property_name)
+
+        return sort_by_index(objects, neighbors_index_name)
+
+    def window_objects(self, windows: Dict[str, List[tuple]]) -> List[Dict]:
+        objects = []
+        with self.lock:
+            for source, intervals in windows.items():
+                for first, last in intervals:
+                    objects.extend(
+                        {"source": source, "chunk_id": chunk_id, "m_time": m_time, "text": text, "_additional": {"id": id}}
+                        for id, chunk_id, m_time, text in self.db.execute(
+                            "SELECT id, chunk_id, m_time, text FROM chunks WHERE source = ? AND chunk_id BETWEEN ? AND ?",
+                            (source, first, last)
+                        )
+                    )
+        return objects
+
+    def close(self):
+        self.db.close()
@@ -1,16 +1,542 @@
+import json
 import requests
+import threading
+import time
+import uuid
+from functools import lru_cache
+from hashlib import sha256
 
 from graphql_query import Operation, Query, Field as GField, Argument, Variable
 from typing import List, Dict
-from requests.exceptions import HTTPError
+from requests.adapters import HTTPAdapter
+from requests.exceptions import HTTPError, Timeout
 from urllib.parse import urlencode
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from rag.cache import cache_key, result_sources
+from rag.metrics import metrics
+
+class CountingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter che notifica on_connect ad ogni connessione TCP aperta (anche le riconnessioni),
+    così da poter misurare quante richieste riusano una connessione del pool.
+    """
+    def __init__(self, on_connect, **kwargs):
+        self.on_connect = on_connect
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        on_connect = self.on_connect
+
+        class CountingHTTPConnection(HTTPConnection):
+            def connect(self):
+                on_connect()
+                super().connect()
+
+        class CountingHTTPSConnection(HTTPSConnection):
+            def connect(self):
+                on_connect()
+                super().connect()
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": type("CountingHTTPConnectionPool", (HTTPConnectionPool,), {"ConnectionCls": CountingHTTPConnection}),
+            "https": type("CountingHTTPSConnectionPool", (HTTPSConnectionPool,), {"ConnectionCls": CountingHTTPSConnection}),
+        }
+
+def endpoint_label(path: str) -> str:
+    """
+    Endpoint di una richiesta per le metriche, senza classe, id o parametri: "graphql", "batch/objects", "objects", ...
+    """
+    parts = path.split("?")[0].strip("/").split("/")
+    if parts[0] == "batch" and len(parts) > 1:
+        return "batch/" + parts[1]
+    return parts[0]
+
+def batch_payload(class_name: str, objects: List[Dict], vectors: List[List[float]] | None = None) -> List[Dict]:
+    payload = [
+        {"class": class_name, "id": str(uuid.uuid4()), "properties": properties}
+        for properties in objects
+    ]
+    if vectors is not None:
+        # con il vettore già presente Weaviate non chiama il vectorizer della classe
+        for item, vector in zip(payload, vectors):
+            item["vector"] = vector
+    return payload
+
+def batch_errors(batch: List[Dict], resp: List[Dict], start: int) -> List[Dict]:
+    errors = []
+    for i, result in enumerate(resp):
+        object_errors = (result.get("result") or {}).get("errors")
+        if object_errors:
+            errors.append({
+                "index": start + i,
+                "id": batch[i]["id"],
+                "errors": [e.get("message") for e in object_errors.get("error", [])]
+            })
+    return errors
+
+class BatchSizer:
+    """
+    Dimensione adattiva dei batch di import: si dimezza su timeout o errori 5xx/413 (e il batch va ritentato)
+    e raddoppia, fino a max_batch_size, quando un batch impiega meno di metà di target_seconds.
+    """
+    def __init__(self, batch_size: int = 100, max_batch_size: int = 1000, target_seconds: float = 2.0):
+        self.size = max(1, batch_size)
+        self.max_batch_size = max_batch_size
+        self.target_seconds = target_seconds
+
+    def retry(self, status: int | None) -> bool:
+        # status None = timeout
+        if self.size > 1 and (status is None or status >= 500 or status == 413):
+            self.size = max(1, self.size // 2)
+            self.max_batch_size = self.size # non si torna più ad una dimensione già fallita
+            return True
+        return False
+
+    def update(self, elapsed: float):
+        if elapsed < self.target_seconds / 2:
+            self.size = min(self.max_batch_size, self.size * 2)
+        elif elapsed > self.target_seconds:
+            self.size = max(1, self.size // 2)
+
+def delete_payload(class_name: str, where: Dict) -> Dict:
+    return {
+        "match": {
+          "class": class_name,
+          "where": where
+        },
+        "output": "verbose",
+        "dryRun": False
+    }
+
+def build_search_query(class_name: str, variables: Dict, properties: List, additional: List, rerank_property: str | None = None) -> str:
+    """
+    Query GraphQL per super_search. Dipende solo dalla forma della ricerca (classe, nomi delle variabili,
+    properties, additional) e dagli INLINE_ARGUMENTS (limit, offset, sort), scritti nella query;
+    gli altri valori viaggiano come variabili. Viene quindi compilata una volta per forma e riusata.
+    Con rerank_property (e la variabile rerankQuery) chiede anche lo score del modulo reranker su quella property.
+    """
+    inline = tuple((name, inline_argument(name, variables[name])) for name in INLINE_ARGUMENTS if name in variables)
+    return compile_search_query(class_name, tuple(sorted(variables.keys())), tuple(properties), tuple(additional or ()), rerank_property, inline)
+
+# argomenti scritti direttamente nella query invece che passati come variabili
+INLINE_ARGUMENTS = ("limit", "offset", "sort")
+
+def inline_argument(name: str, value) -> str:
+    if name == "sort":
+        # order è un enum GraphQL (asc/desc), non una stringa
+        return "[" + ", ".join("{path: " + json.dumps(s["path"]) + ", order: " + s.get("order", "asc") + "}" for s in value) + "]"
+    return json.dumps(value)
+
+def query_variables(variables: Dict) -> Dict:
+    return {name: value for name, value in variables.items() if name not in INLINE_ARGUMENTS}
+
+def search_variable_types(class_name: str) -> Dict[str, str]:
+    return {
+        "where": "GetObjects"+class_name+"WhereInpObj!",
+        "bm25": "GetObjects"+class_name+"HybridGetBm25InpObj!",
+        "hybrid": "GetObjects"+class_name+"HybridInpObj!",
+        "nearText": "GetObjects"+class_name+"NearTextInpObj!",
+        "nearVector": "GetObjects"+class_name+"NearVectorInpObj!",
+        #"limit": "Int!" ERRORE GRAVOTTO
+    }
+
+@lru_cache(maxsize=256)
+def compile_search_query(class_name: str, variable_names: tuple, properties: tuple, additional: tuple, rerank_property: str | None = None, inline: tuple = ()) -> str:
+
+    TYPE_MAP = search_variable_types(class_name)
+
+    variable_objs = {
+        name: Variable(name=name, type=TYPE_MAP[name])
+        for name in variable_names
+        if name in TYPE_MAP
+    }
+
+    arguments = [
+        Argument(name=name, value=variable_objs[name])
+        for name in variable_objs
+    ] + [
+        Argument(name=name, value=value)
+        for name, value in inline
+    ]
+
+    additional = list(additional)
+    if rerank_property and "rerankQuery" in variable_names:
+        # rerankQuery non è un argomento della classe: la usa solo il campo _additional.rerank
+        variable_objs["rerankQuery"] = Variable(name="rerankQuery", type="String")
+        additional.append(GField(
+            name="rerank",
+            arguments=[
+                Argument(name="property", value='"'+rerank_property+'"'),
+                Argument(name="query", value=variable_objs["rerankQuery"])
+            ],
+            fields=["score"]
+        ))
+
+    variable_definitions = list(variable_objs.values())
+
+    fields = list(properties)
+    if (additional):
+        additional_field = GField(name="_additional", fields=additional)
+        fields.append(additional_field)
+
+    query = Query(
+        name="Get",
+        fields=[
+            GField(
+                name=class_name,
+                arguments=arguments,
+                fields=fields
+            )
+        ]
+    )
+    operation = Operation(
+        queries=[query],
+        variables=variable_definitions
+    )
+
+    return operation.render()
+
+def build_multi_search_query(class_name: str, queries: List[Dict], properties: List, additional: List):
+    """
+    Un solo documento GraphQL con una Get per ogni query, distinte dagli alias q0, q1, ...
+    Le variabili di ogni query sono rinominate con il prefisso dell'alias (q0_nearText, q1_where, ...),
+    gli INLINE_ARGUMENTS sono scritti nella Get della query.
+    Restituisce (query, variables).
+    """
+    shapes = tuple(
+        (
+            tuple(sorted(name for name in query_variables if name not in INLINE_ARGUMENTS)),
+            tuple((name, inline_argument(name, query_variables[name])) for name in INLINE_ARGUMENTS if name in query_variables)
+        )
+        for query_variables in queries
+    )
+    variables = {
+        f"q{i}_{name}": value
+        for i, query_variables in enumerate(queries)
+        for name, value in query_variables.items()
+        if name not in INLINE_ARGUMENTS
+    }
+    return compile_multi_search_query(class_name, shapes, tuple(properties), tuple(additional or ())), variables
+
+@lru_cache(maxsize=256)
+def compile_multi_search_query(class_name: str, shapes: tuple, properties: tuple, additional: tuple) -> str:
+
+    TYPE_MAP = search_variable_types(class_name)
+
+    fields = list(properties)
+    if (additional):
+        fields.append(GField(name="_additional", fields=list(additional)))
+
+    variable_definitions = []
+    gets = []
+    for i, (variable_names, inline) in enumerate(shapes):
+        variable_objs = {
+            name: Variable(name=f"q{i}_{name}", type=TYPE_MAP[name])
+            for name in variable_names
+            if name in TYPE_MAP
+        }
+        variable_definitions.extend(variable_objs.values())
+        gets.append(GField(
+            name=class_name,
+            alias=f"q{i}",
+            arguments=[Argument(name=name, value=variable) for name, variable in variable_objs.items()]
+                + [Argument(name=name, value=value) for name, value in inline],
+            fields=fields
+        ))
+
+    operation = Operation(
+        queries=[Query(name="Get", fields=gets)],
+        variables=variable_definitions
+    )
+
+    return operation.render()
+
+def multi_search_results(resp: Dict, count: int) -> List[List[Dict]]:
+    if "errors" in resp:
+        raise(ValueError(resp))
+
+    return [resp['data']['Get'][f"q{i}"] for i in range(count)]
+
+def search_results(resp: Dict, class_name: str) -> List[Dict]:
+    if "errors" in resp:
+        raise(ValueError(resp))
+
+    return resp['data']['Get'][class_name]
+
+def neighbor_windows(objects: List[Dict], neighbors: int, neighbors_index_name: str, key_property_name: str) -> Dict[str, List[tuple]]:
+    """
+    Per ogni source, gli intervalli [chunk_id - neighbors, chunk_id + neighbors] attorno ai risultati,
+    fusi quando si sovrappongono o sono contigui.
+    """
+    ranges = {}
+    for o in objects:
+        cid = o[neighbors_index_name]
+        ranges.setdefault(o[key_property_name], []).append((max(0, cid - neighbors), cid + neighbors))
+
+    windows = {}
+    for src, intervals in ranges.items():
+        merged = []
+        for first, last in sorted(intervals):
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+            else:
+                merged.append((first, last))
+        windows[src] = merged
+    return windows
+
+def windows_size(windows: Dict[str, List[tuple]]) -> int:
+    return sum(last - first + 1 for intervals in windows.values() for first, last in intervals)
+
+def neighbors_where(windows: Dict[str, List[tuple]], neighbors_index_name: str, key_property_name: str) -> Dict:
+    # un operando per finestra (source = src AND first <= chunk_id <= last): cresce con le finestre, non con k*2n
+    operands = [
+        {
+            "operator": "And",
+            "operands": [
+                {"path": [key_property_name],
+                 "operator": "Equal",
+                 "valueString": src},
+                {"path": [neighbors_index_name],
+                 "operator": "GreaterThanEqual",
+                 "valueInt": first},
+                {"path": [neighbors_index_name],
+                 "operator": "LessThanEqual",
+                 "valueInt": last}
+            ]
+        }
+        for src, intervals in windows.items()
+        for first, last in intervals
+    ]
+    if len(operands) == 1:
+        return operands[0]
+    return {"operator": "Or", "operands": operands}
+
+def merge_neighbors(objects: List[Dict], neighbor_objs: List[Dict], neighbors_index_name: str, key_property_name: str) -> List[Dict]:
+    # le finestre contengono anche i risultati originali: li tengo una volta sola, con il loro _additional
+    seen = {(o[key_property_name], o[neighbors_index_name]) for o in objects}
+    return objects + [
+        o for o in neighbor_objs
+        if (o[key_property_name], o[neighbors_index_name]) not in seen
+    ]
+
+def in_windows(o: Dict, windows: Dict[str, List[tuple]], neighbors_index_name: str, key_property_name: str) -> bool:
+    return any(first <= o[neighbors_index_name] <= last for first, last in windows.get(o[key_property_name], ()))
+
+def sort_by_index(objects: List[Dict], neighbors_index_name: str) -> List[Dict]:
+    if objects and neighbors_index_name in objects[0]:
+        return sorted(objects, key=lambda x: x[neighbors_index_name])
+    
+    return objects
+
+def near_text_fields(properties: List, additional: List, neighbors: int, neighbors_property_name: str):
+    """
+    Restituisce copie di properties e additional con i campi richiesti da nearText; le liste del chiamante non vengono modificate.
+    """
+    properties = list(properties)
+    additional = list(additional)
+
+    for a in ['certainty', 'distance', 'score']:
+        if not a in additional:
+            additional.append(a)
+
+    if (neighbors > 0):
+        if not neighbors_property_name in properties:
+            properties.append(neighbors_property_name)
+        if not "id" in additional:
+            additional.append("id")
+
+    return properties, additional
+
+def hybrid_fields(properties: List, additional: List, neighbors: int, neighbors_property_name: str):
+    """
+    Come near_text_fields, per le ricerche hybrid: score ed explainScore al posto di certainty/distance.
+    """
+    properties = list(properties)
+    additional = list(additional)
+
+    for a in ['score', 'explainScore']:
+        if not a in additional:
+            additional.append(a)
+
+    if (neighbors > 0):
+        if not neighbors_property_name in properties:
+            properties.append(neighbors_property_name)
+        if not "id" in additional:
+            additional.append("id")
+
+    return properties, additional
+
+def rerank_score(o: Dict) -> float:
+    rerank = (o.get("_additional") or {}).get("rerank") or [{}]
+    return rerank[0].get("score") or 0.0
+
+def sort_by_rerank(objects: List[Dict], k: int) -> List[Dict]:
+    return sorted(objects, key=rerank_score, reverse=True)[:k]
+
+def build_ask_query(question: str, properties: list[str] | None = None, limit: int = 1, certainty: float | None = None) -> str:
+    args = [
+        Argument(name="question", value=question)
+    ]
+    if properties:
+        args.append(Argument(name="properties", value=properties))
+    if certainty is not None:
+        args.append(Argument(name="certainty", value=certainty))
+
+    ask_arg = Argument(name="ask", value=args)
+    limit_arg = Argument(name="limit", value=limit)
+
+    ask_field = GField(
+        name="DocumentChunk",
+        arguments=[ask_arg, limit_arg],
+        fields=[
+            GField(
+                name="_additional",
+                fields=[
+                    GField(name="answer", fields=[
+                        "hasAnswer", "result", "certainty", "startPosition", "endPosition"
+                    ])
+                ]
+            )
+        ]
+    )
+
+    op = Operation(
+        type="query",
+        queries=[Query(name="Get", fields=[ask_field])]
+    )
+    return op.render()
+
+def build_generate_query(query: str, prompt: str, k: int = 1, alpha: float | None = None) -> str:
+    # filtro di retrieval (vettoriale/ibrido)
+    if alpha is not None:
+        filter_arg = Argument(
+            name="hybrid",
+            value=[
+                Argument(name="query", value=query),
+                Argument(name="alpha", value=alpha)
+            ]
+        )
+    else:
+        filter_arg = Argument(
+            name="nearText",
+            value=[Argument(name="concepts", value=[query])]
+        )
+    limit_arg = Argument(name="limit", value=k)
+
+    generate_args = [
+        Argument(
+            name="singleResult",
+            value=[Argument(name="prompt", value=prompt)]
+        )
+    ]
+    generate_field = GField(
+        name="generate",
+        arguments=generate_args,
+        fields=["singleResult", "error"]
+    )
+
+    rag_field = GField(
+        name="DocumentChunk",
+        arguments=[filter_arg, limit_arg],
+        fields=[
+            GField(name="chunk_id"),
+            GField(name="text"),
+            GField(name="_additional", fields=[generate_field])
+        ]
+    )
+
+    op = Operation(
+        type="query",
+        queries=[Query(name="Get", fields=[rag_field])]
+    )
+    return op.render()
 
 class WeaviateClient:
-    def __init__(self, url, weaviate_api_key):
+    def __init__(self, url, weaviate_api_key, pool_size: int = 10, keep_alive: bool = True, connect_timeout: float = 5.0, read_timeout: float = 60.0, http2: bool = False, cache = None):
         self.url = url.rstrip('/')+'/'
         self.headers = {
             "Content-Type": "application/json",
-            **({"Authorization": "Bearer " + weaviate_api_key} if weaviate_api_key else {})
+            **({"Authorization": "Bearer " + weaviate_api_key} if weaviate_api_key else {}),
+            **({} if keep_alive else {"Connection": "close"})
+        }
+        self.timeout = (connect_timeout, read_timeout)
+        self.http2 = http2
+        self.stats = {"requests": 0, "connections": 0}
+        self.stats_lock = threading.Lock()
+        self.session = self.build_session(pool_size, keep_alive)
+        self.cache = cache
+
+    def build_session(self, pool_size, keep_alive):
+        """
+        Crea la sessione HTTP condivisa da tutte le chiamate api_*: le connessioni
+        restano aperte nel pool e vengono riusate, evitando un handshake TCP/TLS per richiesta.
+        Con http2=True usa httpx (requests non supporta HTTP/2).
+        """
+        if self.http2:
+            try:
+                import httpx
+            except ImportError as e:
+                raise ImportError("http2 richiede il pacchetto 'httpx[http2]'") from e
+
+            return httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size if keep_alive else 0),
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0])
+            )
+
+        session = requests.Session()
+        adapter = CountingAdapter(self.count_connection, pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def close(self):
+        self.session.close()
+
+    def count_connection(self, event_name="connection.connect_tcp.complete", info=None):
+        # chiamato ad ogni nuova connessione TCP (trace hook di httpx o CountingAdapter)
+        if event_name == "connection.connect_tcp.complete":
+            with self.stats_lock:
+                self.stats["connections"] += 1
+
+    def api_request(self, method, url, body=None):
+        with self.stats_lock:
+            self.stats["requests"] += 1
+
+        # url = self.url + versione + "/" + endpoint
+        with metrics.timer("weaviate_request", method=method, endpoint=endpoint_label(url[len(self.url):].partition("/")[2])):
+            return self.send_request(method, url, body)
+
+    def send_request(self, method, url, body=None):
+        if self.http2:
+            import httpx
+            # errori di httpx tradotti in quelli di requests, gli unici che i chiamanti gestiscono
+            try:
+                resp = self.session.request(method, url, json=body, headers=self.headers, extensions={"trace": self.count_connection})
+            except httpx.TimeoutException as e:
+                raise Timeout(f"{e} for url: {url}") from e
+            if resp.is_error:
+                raise HTTPError(f"{resp.status_code} Error for url: {url}", response=resp)
+            return resp
+
+        resp = self.session.request(method, url, json=body, headers=self.headers, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp
+
+    def connection_stats(self):
+        """
+        Statistiche di riuso delle connessioni: richieste effettuate, connessioni aperte e richieste servite da connessioni già aperte.
+        """
+        requests_count = self.stats["requests"]
+        connections = self.stats["connections"]
+        reused = max(requests_count - connections, 0)
+        return {
+            "requests": requests_count,
+            "connections": connections,
+            "reused": reused,
+            "reuse_ratio": round(reused / requests_count, 3) if requests_count else 0.0
         }
 
     def api_build_url(self, name, additional=None, version="v1", params = None):
@@ -24,38 +550,32 @@ class WeaviateClient:
 
     def api_get(self, name, additional="", version="v1"):
         url = self.api_build_url(name, additional, version)
-        resp = requests.get(url, headers=self.headers)
-        resp.raise_for_status()
+        resp = self.api_request("GET", url)
         return resp.json()
 
     def api_post(self, name, body, additional="", version="v1"):
         url = self.api_build_url(name, additional, version)
-        resp = requests.post(url, json=body, headers=self.headers)
-        resp.raise_for_status()
+        resp = self.api_request("POST", url, body)
         return resp.json()
 
     def api_put(self, name, body, additional="", version="v1"):
         url = self.api_build_url(name, additional, version)
-        resp = requests.put(url, json=body, headers=self.headers)
-        resp.raise_for_status()
+        resp = self.api_request("PUT", url, body)
         return resp.json()
 
     def api_delete(self, name, additional="", version="v1"):
         url = self.api_build_url(name, additional, version)
-        resp = requests.delete(url, headers=self.headers)
-        resp.raise_for_status()
+        self.api_request("DELETE", url)
         return
     
     def api_patch(self, name, body, additional="", version="v1", params = None):
         url = self.api_build_url(name, additional, version, params)
-        resp = requests.patch(url, json=body, headers = self.headers)
-        resp.raise_for_status()
+        resp = self.api_request("PATCH", url, body)
         return resp
 
     def api_delete_with_json(self, name, additional="", body=None, version="v1"):
         url = self.api_build_url(name, additional, version)
-        resp = requests.delete(url, json=body, headers=self.headers)
-        resp.raise_for_status()
+        resp = self.api_request("DELETE", url, body)
         return resp.json()
 
     def get_schema(self):
@@ -70,16 +590,23 @@ class WeaviateClient:
     def delete_class(self, class_name):
         return self.api_delete("schema", class_name)
     
+    def add_property(self, class_name, definition):
+        return self.api_post("schema", definition, class_name + "/properties")
+
     def apply_schema(self, definitions: Dict[str, object]) -> Dict[str, object]:
-        
+        """
+        Crea le classi mancanti; alle classi esistenti aggiunge le properties presenti in definitions ma non nello schema
+        (Weaviate non permette di modificare o rimuovere quelle esistenti).
+        Restituisce (classi create, classi invariate, classi fallite, properties aggiunte per classe).
+        """
         created_results: Dict[str, object] = {}
         skipped_class: list[str] = []
         failed_class: list[str] = []
+        added_properties: Dict[str, list[str]] = {}
 
         for class_name, definition in definitions.items():
             try:
-                self.get_class(class_name)
-                skipped_class.append(class_name)
+                existing = self.get_class(class_name)
             
             except HTTPError as e:
                 if e.response.status_code != 404:
@@ -91,8 +618,24 @@ class WeaviateClient:
                     except HTTPError as e:
                         print(e)
                         failed_class.append(class_name)
+                continue
 
-        return (created_results, skipped_class, failed_class)    
+            names = {p["name"] for p in existing.get("properties") or []}
+            missing = [p for p in definition.get("properties", []) if p["name"] not in names]
+            if not missing:
+                skipped_class.append(class_name)
+                continue
+
+            for p in missing:
+                try:
+                    self.add_property(class_name, p)
+                    added_properties.setdefault(class_name, []).append(p["name"])
+                except HTTPError as e:
+                    print(e)
+                    if class_name not in failed_class:
+                        failed_class.append(class_name)
+
+        return (created_results, skipped_class, failed_class, added_properties)
 
     def ingest(self, class_name, **kwargs):
         payload = {
@@ -101,8 +644,39 @@ class WeaviateClient:
         }
         return self.api_post("objects", payload)    
 
+    def ingest_batch(self, class_name, objects: List[Dict], batch_size: int = 100, max_batch_size: int = 1000, target_seconds: float = 2.0, vectors: List[List[float]] | None = None):
+        """
+        Importa una lista di oggetti (dict di proprietà) con POST /v1/batch/objects, con i loro vettori se forniti.
+        La dimensione del batch è adattiva (vedi BatchSizer) e gli id sono assegnati in anticipo,
+        quindi un batch ritentato non crea duplicati.
+        Restituisce (results, errors): errors contiene indice, id e messaggi di ogni oggetto rifiutato.
+        """
+        payload = batch_payload(class_name, objects, vectors)
+        sizer = BatchSizer(batch_size, max_batch_size, target_seconds)
+
+        results = []
+        errors = []
+        start = 0
+
+        while start < len(payload):
+            batch = payload[start:start + sizer.size]
+            began = time.monotonic()
+            try:
+                resp = self.api_post("batch", {"objects": batch}, "objects")
+            except (Timeout, HTTPError) as e:
+                if sizer.retry(e.response.status_code if e.response is not None else None):
+                    continue
+                raise
+
+            sizer.update(time.monotonic() - began)
+            errors.extend(batch_errors(batch, resp, start))
+            results.extend(resp)
+            start += len(batch)
+
+        return results, errors
+
     def get_objects(self, class_name: str, fields = []):
-        fields.append(GField(name="_additional", fields=["id"]))
+        fields = [*fields, GField(name="_additional", fields=["id"])]
         op = Operation(
             type="query",
             queries=[
@@ -121,152 +695,183 @@ class WeaviateClient:
         resp = self.api_post("graphql", {"query": graphql})
         return resp
 
+    def get_objects_page(self, class_name: str, fields: List, limit: int = 1000, after: str | None = None, additional: List = []):
+        """
+        Una pagina di oggetti di class_name in ordine di id, a partire dal cursore after (id dell'ultimo oggetto letto).
+        additional si aggiunge a _additional { id } (es. "vector").
+        """
+        arguments = [Argument(name="limit", value=limit)]
+        if after:
+            arguments.append(Argument(name="after", value='"' + after + '"'))
+
+        op = Operation(
+            type="query",
+            queries=[
+                Query(
+                    name="Get",
+                    fields=[
+                        GField(
+                            name = class_name,
+                            arguments=arguments,
+                            fields=[*fields, GField(name="_additional", fields=["id", *[a for a in additional if a != "id"]])]
+                        )
+                    ]
+                )
+            ]
+        )
+        resp = self.api_post("graphql", {"query": op.render()})
+        return search_results(resp, class_name)
+
+    def iter_objects(self, class_name: str, fields: List, page_size: int = 1000, additional: List = []):
+        """
+        Generatore su tutti gli oggetti di class_name: scorre le pagine con il cursore after,
+        quindi non è soggetto a QUERY_DEFAULTS_LIMIT e tiene in memoria una pagina alla volta.
+        """
+        after = None
+        while True:
+            page = self.get_objects_page(class_name, fields, page_size, after, additional)
+            yield from page
+            if len(page) < page_size:
+                return
+            after = page[-1]["_additional"]["id"]
+
     def patch_object(self, class_name, id, body):
         return self.api_patch("objects", body, additional = class_name + '/' +  id)
 
-    def super_search(self, class_name: str, variables: Dict, properties: List = [], additional : List = [], neighbors = 0, neighbors_index_name="chunk_id", key_property_name="source"):
+    def super_search(self, class_name: str, variables: Dict, properties: List = [], additional : List = [], neighbors = 0, neighbors_index_name="chunk_id", key_property_name="source", rerank_property: str | None = None):
 
-        TYPE_MAP = {
-            "where": "GetObjects"+class_name+"WhereInpObj!",
-            "bm25": "GetObjects"+class_name+"HybridGetBm25InpObj!",
-            "nearText": "GetObjects"+class_name+"NearTextInpObj!",
-            #"limit": "Int!" ERRORE GRAVOTTO
-        }
+        q = build_search_query(class_name, variables, properties, additional, rerank_property)
 
-        variable_objs = {
-            name: Variable(name=name, type=TYPE_MAP[name])
-            for name in variables.keys()
-            if name in TYPE_MAP
-        }
+        #print("QUERY",q, variables)
 
-        variable_definitions = list(variable_objs.values())
+        resp = self.api_post("graphql", {
+            "query": q,
+            "variables": query_variables(variables)
+        })
 
-        arguments = [
-            Argument(name=name, value=variable_objs[name])
-            for name in variable_objs
-        ]
+        objects = search_results(resp, class_name)
 
-        if "limit" in variables:
-            arguments.append(Argument(name="limit", value=variables["limit"]))
-
-        fields = properties
-        if (additional):
-            additional_field = GField(name="_additional", fields=additional)
-            fields.append(additional_field)
-
-        query = Query(
-            name="Get",
-            fields=[
-                GField(
-                    name=class_name,
-                    arguments=arguments,
-                    fields=fields
-                )
-            ]
-        )
-        operation = Operation(
-            queries=[query],
-            variables=variable_definitions
+        objects = self.expand_neighbors(class_name, objects, properties, additional, neighbors, neighbors_index_name, key_property_name)
+
+        return sort_by_index(objects, neighbors_index_name)
+
+    def expand_neighbors(self, class_name: str, objects: List[Dict], properties: List, additional: List, neighbors: int, neighbors_index_name="chunk_id", key_property_name="source") -> List[Dict]:
+        """
+        Aggiunge a objects i chunk vicini (chunk_id +/- neighbors della stessa source) con una sola query;
+        l'ordine dei risultati originali viene mantenuto, i vicini sono accodati.
+        """
+        if neighbors <= 0 or not objects:
+            return objects
+
+        with metrics.timer("neighbor_expansion"):
+            return self.fetch_neighbors(class_name, objects, properties, additional, neighbors, neighbors_index_name, key_property_name)
+
+    def fetch_neighbors(self, class_name: str, objects: List[Dict], properties: List, additional: List, neighbors: int, neighbors_index_name: str, key_property_name: str) -> List[Dict]:
+        windows = neighbor_windows(objects, neighbors, neighbors_index_name, key_property_name)
+
+        # richiamo super_search per le sole finestre dei vicini, disabilitando la ricorsione
+        neighbor_objs = self.super_search(
+            class_name,
+            variables={
+                "where": neighbors_where(windows, neighbors_index_name, key_property_name),
+                "limit": windows_size(windows), # altrimenti Weaviate tronca a QUERY_DEFAULTS_LIMIT
+            },
+            properties=properties,
+            additional=additional,
+            neighbors=0,
+            neighbors_index_name=neighbors_index_name,
+            key_property_name=key_property_name
         )
 
-        q = operation.render()
+        return merge_neighbors(objects, neighbor_objs, neighbors_index_name, key_property_name)
 
-        #print("QUERY",q, variables)
+    def multi_search(self, class_name: str, queries: List[Dict], properties: List = [], additional : List = [], neighbors = 0, neighbors_index_name="chunk_id", key_property_name="source") -> List[List[Dict]]:
+        """
+        Esegue più ricerche (ognuna un dict di variabili come per super_search: nearText, bm25, hybrid, where, limit, ...)
+        in un'unica richiesta GraphQL e restituisce una lista di risultati per query, nello stesso ordine.
+        I vicini vengono cercati una sola volta per tutte le query, con le finestre fuse, e poi ridistribuiti.
+        """
+        if not queries:
+            return []
+
+        properties = list(properties)
+        additional = list(additional)
+        if neighbors > 0:
+            if not neighbors_index_name in properties:
+                properties.append(neighbors_index_name)
+            if not "id" in additional:
+                additional.append("id")
+
+        q, variables = build_multi_search_query(class_name, queries, properties, additional)
 
         resp = self.api_post("graphql", {
             "query": q,
             "variables": variables
         })
 
-        
+        results = multi_search_results(resp, len(queries))
 
-        if "errors" in resp:
-            raise(ValueError(resp))
+        if neighbors > 0:
+            found = [o for objects in results for o in objects]
+            neighbor_objs = self.expand_neighbors(class_name, found, properties, additional, neighbors, neighbors_index_name, key_property_name)[len(found):]
+            # i risultati di una query possono essere vicini di un'altra: fanno parte del pool anche loro
+            pool = list({(o[key_property_name], o[neighbors_index_name]): o for o in found + neighbor_objs}.values())
+            expanded = []
+            for objects in results:
+                windows = neighbor_windows(objects, neighbors, neighbors_index_name, key_property_name)
+                own = [o for o in pool if in_windows(o, windows, neighbors_index_name, key_property_name)]
+                expanded.append(merge_neighbors(objects, own, neighbors_index_name, key_property_name))
+            results = expanded
 
-        
+        return [sort_by_index(objects, neighbors_index_name) for objects in results]
 
-        objects=resp['data']['Get'][class_name]
-
-        if neighbors > 0 and objects:
-            # 1) costruisco (chunk_id, source) dei vicini
-            neighbor_pairs = set()
-            for o in objects:
-                cid = o[neighbors_index_name]
-                src = o[key_property_name]
-                for delta in range(1, neighbors+1):
-                    if cid - delta >= 0:
-                        neighbor_pairs.add((cid - delta, src))
-                    neighbor_pairs.add((cid + delta, src))
-
-            # 2) filtro GraphQL OR-of-ANDs
-            where_filter = {
-                "operator": "Or",
-                "operands": [
-                    {
-                        "operator": "And",
-                        "operands": [
-                            {"path": [neighbors_index_name],
-                             "operator": "Equal",
-                             "valueInt": neigh_cid},
-                            {"path": [key_property_name],
-                             "operator": "Equal",
-                             "valueString": neigh_src}
-                        ]
-                    }
-                    for neigh_cid, neigh_src in neighbor_pairs
-                ]
-            }
+    def cached(self, key: str, compute, key_property_name="source"):
+        """
+        Risultato di compute() passando per self.cache (se configurata), etichettato con le source trovate.
+        """
+        if self.cache is None:
+            return compute()
 
-            # 3) richiamo super_search per i soli neighbor, disabilitando la ricorsione
-            neighbor_objs = self.super_search(
-                class_name,
-                variables={
-                    "where": where_filter,
-                    #"limit": len(neighbor_pairs),
-                },
-                properties=properties,
-                additional=additional,
-                neighbors=0,
-                neighbors_index_name=neighbors_index_name,
-                key_property_name=key_property_name
-            )
+        objects = self.cache.get(key)
+        if objects is None:
+            objects = compute()
+            self.cache.set(key, objects, result_sources(objects, key_property_name))
+        return objects
 
-            # 4) unisco e ordino
-            objects.extend(neighbor_objs)
+    def cached_search(self, class_name: str, variables: Dict, properties: List = [], additional : List = [], neighbors = 0, neighbors_index_name="chunk_id", key_property_name="source"):
+        """
+        super_search passando per self.cache (se configurata). Da usare per le ricerche degli utenti,
+        non per le letture di stato fatte durante l'ingest.
+        """
+        return self.cached(
+            cache_key(class_name, variables, properties, additional, variables.get("limit"), neighbors),
+            lambda: self.super_search(class_name, variables, properties, additional, neighbors, neighbors_index_name, key_property_name),
+            key_property_name
+        )
 
-        if objects and neighbors_index_name in objects[0]:
-            return sorted(objects, key=lambda x: x[neighbors_index_name])
-        
-        return objects
-                        
-    def delete_objects(self, class_name: str, where: Dict):
-        payload = {
-            "match": {
-              "class": class_name,
-              "where": where
-            },
-            "output": "verbose",
-            "dryRun": False
-        }
+    def invalidate_source(self, source: str):
+        if self.cache is not None:
+            self.cache.invalidate_source(source)
 
-        resp = self.api_delete_with_json("batch", "objects", payload)
+    def invalidate_all(self):
+        if self.cache is not None:
+            self.cache.clear()
+
+    def delete_objects(self, class_name: str, where: Dict):
+        resp = self.api_delete_with_json("batch", "objects", delete_payload(class_name, where))
 
         return resp
 
     def delete_document_chunks_by_source(self, source: str):
 
-        payload = {
-            "match": {
-              "class": "DocumentChunk",
-              "where": {
+        payload = delete_payload(
+            "DocumentChunk",
+            {
                 "path": ["source"],
                 "operator": "Equal",
                 "valueString": source
-              }
-            },
-            "output": "verbose",
-            "dryRun": False
-        }
+            }
+        )
 
         resp = self.api_delete_with_json("batch", "objects", payload)
 
@@ -275,17 +880,9 @@ class WeaviateClient:
 
     def nearText(self, class_name: str, text: str, properties : list[str], additional: list[str], k: int = 1, neighbors: int = 1, neighbors_property_name: str = "chunk_id", same_property_name: str = "source"):
 
-        for a in ['certainty', 'distance', 'score']:
-            if not a in additional:
-                additional.append(a)
+        properties, additional = near_text_fields(properties, additional, neighbors, neighbors_property_name)
 
-        if (neighbors > 0):
-            if not neighbors_property_name in properties:
-                properties.append(neighbors_property_name)
-            if not "id" in additional:
-                additional.append("id")
-
-        objects = self.super_search(
+        objects = self.cached_search(
             class_name,
             {
                 "nearText": {
@@ -303,6 +900,61 @@ class WeaviateClient:
         return objects
         
 
+
+    def nearVector(self, class_name: str, vector: List[float], properties : list[str], additional: list[str], k: int = 1, neighbors: int = 1, neighbors_property_name: str = "chunk_id", same_property_name: str = "source"):
+        """
+        Come nearText, ma con il vettore della query già calcolato: Weaviate non richiama il vectorizer.
+        """
+        properties, additional = near_text_fields(properties, additional, neighbors, neighbors_property_name)
+
+        variables = {
+            "nearVector": {
+                "vector": vector,
+            },
+            "limit": k
+        }
+
+        # in chiave l'impronta del vettore, non centinaia di float
+        digest = sha256(json.dumps(vector).encode()).hexdigest()
+        return self.cached(
+            cache_key(class_name, {"nearVector": digest, "limit": k}, properties, additional, k, neighbors),
+            lambda: self.super_search(class_name, variables, properties, additional, neighbors, neighbors_property_name, same_property_name),
+            same_property_name
+        )
+
+    def hybrid(self, class_name: str, text: str, properties: list[str], additional: list[str], alpha: float = 0.5, fusion_type: str = "relativeScoreFusion", k: int = 3, neighbors: int = 0, rerank: bool = False, rerank_property: str = "text", rerank_candidates: int | None = None, neighbors_property_name: str = "chunk_id", same_property_name: str = "source"):
+        """
+        Ricerca hybrid (bm25 + vettoriale) con fusione lato server: alpha pesa la parte vettoriale (0 = solo bm25, 1 = solo vettori),
+        fusion_type è rankedFusion o relativeScoreFusion.
+        Con rerank i primi rerank_candidates (default k*4) risultati vengono riordinati dal modulo reranker nella stessa query
+        e tagliati a k; i vicini vengono aggiunti dopo il taglio. I risultati restano in ordine di rilevanza, vicini in coda.
+        """
+        properties, additional = hybrid_fields(properties, additional, neighbors, neighbors_property_name)
+
+        variables = {
+            "hybrid": {
+                "query": text,
+                "alpha": alpha,
+                "fusionType": fusion_type
+            },
+            "limit": (rerank_candidates or k * 4) if rerank else k
+        }
+        if rerank:
+            variables["rerankQuery"] = text
+
+        def compute():
+            # niente super_search: ordinerebbe per chunk_id, qui conta l'ordine di rilevanza
+            q = build_search_query(class_name, variables, properties, additional, rerank_property if rerank else None)
+            objects = search_results(self.api_post("graphql", {"query": q, "variables": query_variables(variables)}), class_name)
+            if rerank:
+                objects = sort_by_rerank(objects, k)
+            return self.expand_neighbors(class_name, objects, properties, additional, neighbors, neighbors_property_name, same_property_name)
+
+        return self.cached(
+            cache_key(class_name, {**variables, "rerank": rerank_property if rerank else None}, properties, additional, k, neighbors),
+            compute,
+            same_property_name
+        )
     def ask(self,
             question: str,
             properties: list[str] | None = None,
@@ -313,37 +965,7 @@ class WeaviateClient:
         Esegue una query 'ask' su Weaviate utilizzando il modulo qna-openai.
         Restituisce la risposta estratta con campo 'result'.
         """
-        args = [
-            Argument(name="question", value=question)
-        ]
-        if properties:
-            args.append(Argument(name="properties", value=properties))
-        if certainty is not None:
-            args.append(Argument(name="certainty", value=certainty))
-
-        ask_arg = Argument(name="ask", value=args)
-        limit_arg = Argument(name="limit", value=limit)
-
-        ask_field = GField(
-            name="DocumentChunk",
-            arguments=[ask_arg, limit_arg],
-            fields=[
-                GField(
-                    name="_additional",
-                    fields=[
-                        GField(name="answer", fields=[
-                            "hasAnswer", "result", "certainty", "startPosition", "endPosition"
-                        ])
-                    ]
-                )
-            ]
-        )
-
-        op = Operation(
-            type="query",
-            queries=[Query(name="Get", fields=[ask_field])]
-        )
-        gql = op.render()
+        gql = build_ask_query(question, properties, limit, certainty)
         resp = self.api_post("graphql", {"query": gql})
         return resp.get("data", {}).get("Get", {}).get("DocumentChunk", [])
 
@@ -362,49 +984,6 @@ class WeaviateClient:
 
         Restituisce i testi generati per ogni risultato.
         """
-        # filtro di retrieval (vettoriale/ibrido)
-        if alpha is not None:
-            filter_arg = Argument(
-                name="hybrid",
-                value=[
-                    Argument(name="query", value=query),
-                    Argument(name="alpha", value=alpha)
-                ]
-            )
-        else:
-            filter_arg = Argument(
-                name="nearText",
-                value=[Argument(name="concepts", value=[query])]
-            )
-        limit_arg = Argument(name="limit", value=k)
-
-        generate_args = [
-            Argument(
-                name="singleResult",
-                value=[Argument(name="prompt", value=prompt)]
-            )
-        ]
-        generate_field = Gield(
-            name="generate",
-            arguments=generate_args,
-            fields=["singleResult", "error"]
-        )
-
-        rag_field = GField(
-            name="DocumentChunk",
-            arguments=[filter_arg, limit_arg],
-            fields=[
-                GField(name="chunk_id"),
-                GField(name="text"),
-                GField(name="_additional", fields=[generate_field])
-            ]
-        )
-
-        op = Operation(
-            type="query",
-            queries=[Query(name="Get", fields=[rag_field])]
-        )
-        gql = op.render()
+        gql = build_generate_query(query, prompt, k, alpha)
         resp = self.api_post("graphql", {"query": gql})
         return resp.get("data", {}).get("Get", {}).get("DocumentChunk", [])
-
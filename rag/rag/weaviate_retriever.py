@@ -1,14 +1,81 @@
 from langchain.schema.retriever import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun
 from typing import List, Dict
-from weaviate_client import WeaviateClient
+from rag.weaviate_client import WeaviateClient
+from rag.async_weaviate_client import AsyncWeaviateClient
+from rag.cache import MemoryCache, cache_key
+from rag.context import object_score
 from langchain.schema import Document
+from pydantic import Field
+
+PROPERTIES = ["source", "chunk_id", "m_time", "text"]
+ADDITIONAL = ["id"]
+
+def to_document(o: Dict) -> Document:
+    additional = o.get("_additional") or {}
+    return Document(
+        page_content=o.get("text") or "",
+        metadata={
+            "source": o.get("source"),
+            "chunk_id": o.get("chunk_id"),
+            "m_time": o.get("m_time"),
+            "id": additional.get("id"),
+            # certainty per nearText (lo score di Weaviate lì vale "0"), score per hybrid
+            "score": object_score(o),
+        }
+    )
 
 class WeaviateRetriever(BaseRetriever):
+    """
+    Retriever LangChain su DocumentChunk: nearText (default) o hybrid, con i vicini di ogni risultato.
+    I Document portano source, chunk_id e score nei metadata. I risultati sono tenuti in una piccola cache LRU
+    per query, così le richieste ripetute nello stesso turno (o nei turni successivi) non rifanno la ricerca.
+    """
     client: WeaviateClient
+    async_client: AsyncWeaviateClient | None = None
+    class_name: str = "DocumentChunk"
+    search: str = "nearText"
+    alpha: float = 0.5
+    rerank: bool = False
     k: int = 3
     neighbors: int = 1
+    cache: MemoryCache | None = Field(default_factory=lambda: MemoryCache(maxsize=128, ttl=300))
+
+    def key(self, query: str) -> str:
+        return cache_key(self.class_name, {"query": query, "search": self.search, "alpha": self.alpha, "rerank": self.rerank}, PROPERTIES, ADDITIONAL, self.k, self.neighbors)
+
+    def cached(self, query: str):
+        if self.cache is None:
+            return None
+        return self.cache.get(self.key(query))
+
+    def remember(self, query: str, objects: List[Dict]):
+        if self.cache is not None:
+            self.cache.set(self.key(query), objects)
+
+    def search_sync(self, query: str) -> List[Dict]:
+        if self.search == "hybrid":
+            return self.client.hybrid(self.class_name, query, PROPERTIES, ADDITIONAL, alpha=self.alpha, k=self.k, neighbors=self.neighbors, rerank=self.rerank)
+        return self.client.nearText(self.class_name, query, PROPERTIES, ADDITIONAL, k=self.k, neighbors=self.neighbors)
+
+    async def search_async(self, query: str) -> List[Dict]:
+        if self.search == "hybrid":
+            return await self.async_client.hybrid(self.class_name, query, PROPERTIES, ADDITIONAL, alpha=self.alpha, k=self.k, neighbors=self.neighbors, rerank=self.rerank)
+        return await self.async_client.nearText(self.class_name, query, PROPERTIES, ADDITIONAL, k=self.k, neighbors=self.neighbors)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        objects = self.cached(query)
+        if objects is None:
+            objects = self.search_sync(query)
+            self.remember(query, objects)
+        return [to_document(o) for o in objects]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        if self.async_client is None:
+            return await super()._aget_relevant_documents(query, run_manager=run_manager)
 
-    def _get_relevant_documents(self, query: str) -> List[Document]:
-        raw = self.client.query(query, self.k, self.neighbors)
-        parts = [p for p in raw.split("\n\n---\n\n") if p.strip()]
-        return [Document(page_content=p) for p in parts]
+        objects = self.cached(query)
+        if objects is None:
+            objects = await self.search_async(query)
+            self.remember(query, objects)
+        return [to_document(o) for o in objects]
@@ -0,0 +1,50 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from benchmarks import mock_services
+from rag.app import RagApp
+from rag.auth import get_oauth_session
+
+@pytest.fixture(scope="session")
+def mock_url():
+    server, url = mock_services.start()
+    yield url
+    server.shutdown()
+
+@pytest.fixture
+def store(mock_url):
+    # archivio vuoto per ogni test: il server è condiviso, i dati no
+    mock_services.Handler.store = mock_services.Store()
+    return mock_services.Handler.store
+
+@pytest.fixture
+def app(mock_url, store):
+    app = RagApp(mock_url, None)
+    yield app
+    app.get_weaviate_client().close()
+
+@pytest.fixture
+def tika(mock_url, tmp_path, monkeypatch):
+    # Tika e OIDC finti: put_tika restituisce il contenuto del file
+    monkeypatch.setenv("TIKA_EXTRACT_ENDPOINT", mock_url + "/tika")
+    monkeypatch.setenv("OIDC_TOKEN_ENDPOINT", mock_url + "/token")
+    monkeypatch.setenv("OIDC_CLIENT_ID", "test")
+    monkeypatch.setenv("OIDC_CLIENT_SECRET", "test")
+    monkeypatch.setenv("TOKEN_FILE", str(tmp_path / "token.json"))
+    get_oauth_session.cache_clear()
+    yield
+    get_oauth_session.cache_clear()
+
+@pytest.fixture
+def write_file(tmp_path):
+    """
+    Scrive un file di testo sotto tmp_path e restituisce (percorso assoluto, size, m_time) come iter_files.
+    """
+    def write(name: str, text: str):
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding="utf-8")
+        stat = path.stat()
+        return str(path), stat.st_size, datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+    return write
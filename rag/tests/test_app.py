@@ -0,0 +1,45 @@
+import random
+
+from rag.app import iter_split_text, split_text_with_langchain
+
+def test_get_documents_leaves_out_text_unless_asked(app, store):
+    store.put("Document", "00000000-0000-0000-0000-000000000001", {"source": "/a", "vectorized": True, "text": "testo intero"})
+
+    assert list(app.get_documents()) == [{"source": "/a", "vectorized": True, "_additional": {"id": "00000000-0000-0000-0000-000000000001"}}]
+    assert [d["text"] for d in app.get_documents(20, with_text=True)] == ["testo intero"]
+
+def sample_text(paragraphs: int = 300) -> str:
+    rng = random.Random(0)
+    words = ["alpha", "beta", "gamma", "delta", "epsilon"]
+    return "\n\n".join(
+        ". ".join(" ".join(rng.choice(words) for _ in range(rng.randint(3, 15))) for _ in range(rng.randint(1, 6)))
+        for _ in range(paragraphs)
+    )
+
+def test_iter_split_text_matches_split_on_the_whole_text():
+    text = sample_text()
+    pieces = [text[i:i + 777] for i in range(0, len(text), 777)]
+    assert list(iter_split_text(pieces, 1000, 200)) == split_text_with_langchain(text, 1000, 200)
+
+def test_iter_split_text_yields_before_reading_everything():
+    text = sample_text()
+    consumed = []
+
+    def pieces():
+        for i in range(0, len(text), 500):
+            consumed.append(i)
+            yield text[i:i + 500]
+
+    next(iter_split_text(pieces(), 1000, 200))
+    assert len(consumed) * 500 <= 1000 * 8 + 500
+
+def test_store_without_text_clears_the_previous_text(app, store, write_file):
+    path, size, m_time = write_file("doc.txt", "prima versione")
+    app.store(path, size, m_time, "h1", None, "prima versione", ["prima versione"])
+    doc_id = app.get_document_id_by_file_path(path)
+
+    app.store(path, size, m_time, "h2", doc_id, None, ["seconda versione"])
+
+    [(_, document)] = store.select("Document")
+    assert document["text"] == ""
+    assert document["hash"] == "h2"
@@ -0,0 +1,68 @@
+from rag.cache import MemoryCache, SQLiteCache, cache_key, make_cache
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(maxsize=2, ttl=None)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+def test_memory_cache_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("rag.cache.time.time", lambda: now[0])
+    cache = MemoryCache(ttl=10)
+    cache.set("a", 1)
+    now[0] += 11
+    assert cache.get("a") is None
+
+def test_memory_cache_returns_copies():
+    cache = MemoryCache(ttl=None)
+    cache.set("a", [{"source": "/x"}])
+    cache.get("a")[0]["source"] = "/y"
+    assert cache.get("a") == [{"source": "/x"}]
+
+def test_invalidate_source_drops_only_tagged_entries(tmp_path):
+    for cache in (MemoryCache(ttl=None), SQLiteCache(str(tmp_path / "cache.sqlite"), ttl=None)):
+        cache.set("a", [{"source": "/x"}], {"/x"})
+        cache.set("b", [{"source": "/y"}], {"/y"})
+        cache.invalidate_source("/x")
+        assert cache.get("a") is None
+        assert cache.get("b") == [{"source": "/y"}]
+        cache.clear()
+        assert cache.get("b") is None
+
+def test_cache_key_ignores_dict_order():
+    assert cache_key("C", {"a": 1, "b": 2}, ["text"], ["id"], 3, 0) == cache_key("C", {"b": 2, "a": 1}, ["text"], ["id"], 3, 0)
+
+def test_make_cache_backends(tmp_path):
+    assert make_cache("none") is None
+    assert isinstance(make_cache("memory"), MemoryCache)
+    assert isinstance(make_cache("sqlite", path=str(tmp_path / "c.sqlite")), SQLiteCache)
+
+def test_ingesting_new_chunks_clears_cached_searches(app, write_file):
+    client = app.get_weaviate_client()
+    client.cache = MemoryCache(ttl=None)
+    client.cached("query", lambda: [{"source": "/other"}])
+
+    path, size, m_time = write_file("new.txt", "nuovo contenuto")
+    app.store(path, size, m_time, "hash", None, None, ["nuovo contenuto"])
+
+    assert client.cache.get("query") is None
+
+def test_unchanged_chunks_only_invalidate_their_source(app, write_file):
+    client = app.get_weaviate_client()
+    path, size, m_time = write_file("doc.txt", "testo")
+    app.store(path, size, m_time, "hash", None, None, ["testo"])
+
+    client.cache = MemoryCache(ttl=None)
+    client.cached("other", lambda: [{"source": "/other"}])
+    client.cached("mine", lambda: [{"source": path}])
+
+    doc_id = app.get_document_id_by_file_path(path)
+    app.store(path, size, m_time, "hash", doc_id, None, ["testo"])
+
+    assert client.cache.get("other") == [{"source": "/other"}]
+    assert client.cache.get("mine") is None
@@ -0,0 +1,51 @@
+import os
+import sys
+
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+# chatbot.py si avvia come script da rag/ e importa i moduli vicini senza il package
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "rag"))
+from chatbot import ChatPipeline, estimated_token_ids
+
+class Retriever:
+    def __init__(self):
+        self.queries = []
+
+    def invoke(self, query):
+        self.queries.append(query)
+        return []
+
+def pipeline(llm, memory, retriever, answers):
+    answer_llm = FakeListChatModel(responses=answers)
+    return ChatPipeline(llm, answer_llm, retriever, memory)
+
+def test_needs_condense_counts_a_summary_as_history():
+    qa = ChatPipeline(None, None, None, None)
+    assert not qa.needs_condense([])
+    assert qa.needs_condense([SystemMessage("riassunto")])
+    assert qa.needs_condense([SystemMessage("riassunto"), AIMessage("risposta")])
+    assert qa.needs_condense([HumanMessage("domanda"), AIMessage("risposta")])
+    assert not ChatPipeline(None, None, None, None, min_history_turns=2).needs_condense([HumanMessage("domanda"), AIMessage("risposta")])
+
+def test_follow_up_is_condensed_after_the_turn_is_summarized():
+    # il primo turno supera max_token_limit e resta solo il riassunto
+    llm = FakeListChatModel(responses=["riassunto", "quali altri formati supporta Tika?", "riassunto"], custom_get_token_ids=estimated_token_ids)
+    memory = ConversationSummaryBufferMemory(
+        llm=llm,
+        max_token_limit=20,
+        memory_key="chat_history",
+        return_messages=True,
+        output_key="answer"
+    )
+    retriever = Retriever()
+    qa = pipeline(llm, memory, retriever, ["risposta lunga " * 50] * 2)
+
+    qa.invoke({"question": "quali formati supporta Tika?"})
+    assert [m.type for m in qa.history()] == ["system"]
+
+    resp = qa.invoke({"question": "e poi?"})
+
+    assert resp["generated_question"] == "quali altri formati supporta Tika?"
+    assert retriever.queries[-1] == "quali altri formati supporta Tika?"
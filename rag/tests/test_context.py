@@ -0,0 +1,22 @@
+import uuid
+
+from rag.context import estimate_tokens, object_score, pack_context
+
+def test_object_score_prefers_certainty_to_the_zero_score_of_near_text():
+    assert object_score({"_additional": {"score": "0", "certainty": 0.9, "distance": 0.2}}) == 0.9
+    assert object_score({"_additional": {"score": "0", "distance": 0.25}}) == 0.75
+    assert object_score({"_additional": {"score": "1.5", "certainty": None, "distance": None}}) == 1.5
+    assert object_score({"_additional": {"id": "x"}}) is None
+
+def test_pack_context_keeps_the_best_near_text_hit(app, store):
+    best = "gamma delta " * 20
+    for source, text in (("/a", "nothing relevant " * 20), ("/b", best)):
+        store.put("DocumentChunk", str(uuid.uuid4()), {"source": source, "chunk_id": 0, "text": text})
+
+    found = app.get_weaviate_client().nearText("DocumentChunk", "gamma delta", ["source", "text"], ["id"], k=2, neighbors=1)
+    assert all(o["_additional"]["score"] == "0" for o in found)
+
+    # l'ordine di arrivo non conta: decide lo score
+    passages = pack_context(sorted(found, key=lambda o: o["source"]), token_budget=estimate_tokens(best))
+
+    assert [p["source"] for p in passages] == ["/b"]
@@ -0,0 +1,86 @@
+import os
+
+from benchmarks import mock_services
+
+SOURCE_PROPERTIES = ["size", "source", "m_time", "vectorized", "hash", "prehash"]
+
+def write_corpus(root, count: int = 3):
+    os.makedirs(root, exist_ok=True)
+    for i in range(count):
+        with open(os.path.join(root, f"doc{i}.txt"), "w", encoding="utf-8") as f:
+            f.write(f"documento {i}. " * 200)
+
+def objects(store, class_name):
+    return [o for _, o in store.select(class_name)]
+
+def test_ingest_and_unchanged_rescan(app, store, tika, tmp_path):
+    root = str(tmp_path / "corpus")
+    write_corpus(root)
+
+    app.ingest_path(root, recursive=True)
+    chunks = len(objects(store, "DocumentChunk"))
+    assert chunks > 3
+    assert len(objects(store, "Document")) == 3
+
+    app.ingest_path(root, recursive=True)
+    assert len(objects(store, "DocumentChunk")) == chunks
+    assert len(objects(store, "Document")) == 3
+
+def test_rescan_is_safe_when_the_source_lookup_misses_a_document(app, store, tika, tmp_path, monkeypatch):
+    root = str(tmp_path / "corpus")
+    write_corpus(root)
+    app.ingest_path(root, recursive=True)
+    chunks = len(objects(store, "DocumentChunk"))
+
+    find_documents = app.find_documents
+    def lossy_find_documents(property_name, values, properties, page_size=200):
+        found = find_documents(property_name, values, properties, page_size)
+        return found[1:] if property_name == "source" else found
+    monkeypatch.setattr(app, "find_documents", lossy_find_documents)
+
+    app.ingest_path(root, recursive=True)
+
+    # il file sfuggito alla ricerca per source non è un duplicato di sé stesso: chunk e Document restano
+    assert len(objects(store, "DocumentChunk")) == chunks
+    assert len(objects(store, "Document")) == 3
+    assert all(d["vectorized"] for d in objects(store, "Document"))
+
+def test_duplicate_files_are_ingested_once(app, store, tika, tmp_path):
+    root = tmp_path / "corpus"
+    root.mkdir()
+    (root / "a.txt").write_text("stesso contenuto " * 100, encoding="utf-8")
+    (root / "b.txt").write_text("stesso contenuto " * 100, encoding="utf-8")
+
+    app.ingest_path(str(root), recursive=True)
+
+    assert len(objects(store, "Document")) == 1
+    assert {o["source"] for o in objects(store, "DocumentChunk")} == {d["source"] for d in objects(store, "Document")}
+
+def test_is_duplicated_by_hash_ignores_the_file_itself(app, store, monkeypatch):
+    store.put("Document", "00000000-0000-0000-0000-000000000001", {"source": "/a.txt", "hash": "h"})
+    store.put("Document", "00000000-0000-0000-0000-000000000002", {"source": "/b.txt", "hash": "h"})
+    monkeypatch.setattr(app, "get_hash", lambda file_path: "h")
+
+    duplicates, hash = app.is_duplicated_by_hash("/a.txt")
+
+    assert [d["source"] for d in duplicates] == ["/b.txt"]
+    assert hash == "h"
+
+def test_find_documents_pages_past_token_matches(app, store):
+    # "/data/My Documents/..." ha il token "Documents/..." in comune con ogni file della cartella
+    for i in range(25):
+        store.put("Document", f"00000000-0000-0000-0000-{i:012d}", {"source": f"/data/My Documents/f{i}.txt", "hash": str(i)})
+
+    found = app.find_documents("source", ["/data/My Documents/f24.txt", "/other/x.txt"], SOURCE_PROPERTIES, page_size=2)
+
+    assert [d["source"] for d in found] == ["/data/My Documents/f24.txt"]
+
+def test_find_documents_is_exact_beyond_query_maximum_results(app, store):
+    # più di QUERY_MAXIMUM_RESULTS Document con il token "Documents/..." in comune: ContainsAny li troverebbe tutti
+    for i in range(mock_services.QUERY_MAXIMUM_RESULTS + 500):
+        store.put("Document", f"00000000-0000-0000-0000-{i:012d}", {"source": f"/srv/My Documents/f{i}.txt", "hash": str(i)})
+    store.put("Document", "10000000-0000-0000-0000-000000000000", {"source": "/srv/My Documents/f1.txt x", "hash": "x"})
+
+    found = app.find_documents("source", ["/srv/My Documents/f1.txt"], SOURCE_PROPERTIES)
+
+    assert [d["source"] for d in found] == ["/srv/My Documents/f1.txt"]
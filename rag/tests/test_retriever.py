@@ -0,0 +1,14 @@
+import uuid
+
+from rag.weaviate_retriever import WeaviateRetriever
+
+def test_near_text_documents_carry_the_certainty_as_score(app, store):
+    for i, text in enumerate(["zero", "one gamma", "two"]):
+        store.put("DocumentChunk", str(uuid.uuid4()), {"source": "/a", "chunk_id": i, "text": text})
+    retriever = WeaviateRetriever(client=app.get_weaviate_client(), k=1, neighbors=1)
+
+    docs = retriever.invoke("gamma")
+
+    best = next(d for d in docs if d.metadata["chunk_id"] == 1)
+    assert best.metadata["score"] == 1.0
+    assert all(d.metadata["score"] != 0.0 for d in docs)
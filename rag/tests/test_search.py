@@ -0,0 +1,85 @@
+import uuid
+
+from rag.weaviate_client import build_multi_search_query, neighbor_windows, neighbors_where, windows_size
+
+def chunk(source, chunk_id):
+    return {"source": source, "chunk_id": chunk_id}
+
+def test_neighbor_windows_merge_overlapping_and_contiguous_ranges():
+    objects = [chunk("/a", 5), chunk("/a", 1), chunk("/a", 8), chunk("/b", 0)]
+
+    windows = neighbor_windows(objects, 1, "chunk_id", "source")
+
+    # 0-2 e 4-6 restano separate, 4-6 e 7-9 sono contigue e si fondono
+    assert windows == {"/a": [(0, 2), (4, 9)], "/b": [(0, 1)]}
+    assert windows_size(windows) == 11
+
+def test_neighbors_where_has_one_operand_per_window():
+    where = neighbors_where({"/a": [(0, 2), (4, 9)]}, "chunk_id", "source")
+    assert where["operator"] == "Or"
+    assert len(where["operands"]) == 2
+    assert neighbors_where({"/a": [(0, 2)]}, "chunk_id", "source")["operator"] == "And"
+
+def test_multi_search_query_uses_aliases_and_prefixed_variables():
+    q, variables = build_multi_search_query(
+        "DocumentChunk",
+        [{"nearText": {"concepts": ["a"]}, "limit": 2}, {"bm25": {"query": "b"}, "limit": 3}],
+        ["text"],
+        ["id"]
+    )
+    assert "q0: DocumentChunk" in q and "q1: DocumentChunk" in q
+    assert variables == {"q0_nearText": {"concepts": ["a"]}, "q1_bm25": {"query": "b"}}
+
+def put_chunks(store, source, texts):
+    for i, text in enumerate(texts):
+        store.put("DocumentChunk", str(uuid.uuid4()), {"source": source, "chunk_id": i, "text": text})
+
+TEXTS = ["zero", "one", "two alpha", "three beta", "four", "five", "six", "seven gamma", "eight", "nine"]
+
+def test_super_search_adds_neighbors_in_chunk_order(app, store):
+    put_chunks(store, "/a", TEXTS)
+
+    found = app.get_weaviate_client().nearText("DocumentChunk", "gamma", ["source", "text"], ["id"], k=1, neighbors=2)
+
+    assert [o["chunk_id"] for o in found] == [5, 6, 7, 8, 9]
+
+def test_multi_search_returns_each_query_with_its_own_neighbors(app, store):
+    put_chunks(store, "/a", TEXTS)
+    put_chunks(store, "/b", ["other alpha"])
+
+    results = app.get_weaviate_client().multi_search(
+        "DocumentChunk",
+        [
+            {"nearText": {"concepts": ["beta"]}, "limit": 1},
+            {"where": {"operator": "And", "operands": [
+                {"operator": "Equal", "path": ["source"], "valueString": "/a"},
+                {"operator": "Equal", "path": ["chunk_id"], "valueInt": 0}
+            ]}, "limit": 1},
+            {"nearText": {"concepts": ["gamma"]}, "limit": 1},
+            {"where": {"operator": "Equal", "path": ["source"], "valueString": "/missing"}, "limit": 1}
+        ],
+        properties=["source", "text"],
+        neighbors=1
+    )
+
+    assert [[o["chunk_id"] for o in objects] for objects in results] == [[2, 3, 4], [0, 1], [6, 7, 8], []]
+    assert all(o["source"] == "/a" for objects in results for o in objects)
+
+def test_multi_search_without_neighbors(app, store):
+    put_chunks(store, "/a", TEXTS)
+
+    results = app.get_weaviate_client().multi_search(
+        "DocumentChunk",
+        [{"nearText": {"concepts": ["alpha"]}, "limit": 1}, {"bm25": {"query": "beta"}, "limit": 1}],
+        properties=["text"]
+    )
+
+    assert [[o["text"] for o in objects] for objects in results] == [["two alpha"], ["three beta"]]
+
+def test_hybrid_keeps_relevance_order_and_appends_neighbors(app, store):
+    put_chunks(store, "/a", TEXTS)
+
+    found = app.hybrid("gamma alpha two", k=2, neighbors=1)
+
+    assert [o["chunk_id"] for o in found[:2]] == [2, 7]
+    assert sorted(o["chunk_id"] for o in found[2:]) == [1, 3, 6, 8]
@@ -0,0 +1,93 @@
+import uuid
+
+from rag.app import chunk_hash
+
+SOURCE = "/docs/a.txt"
+
+def chunks_in(store, source=SOURCE):
+    return sorted((o["chunk_id"], o["text"]) for _, o in store.select("DocumentChunk") if o["source"] == source)
+
+def put_chunk(store, chunk_id, text, source=SOURCE):
+    id = str(uuid.uuid4())
+    store.put("DocumentChunk", id, {"source": source, "chunk_id": chunk_id, "text": text, "chunk_hash": chunk_hash(text)})
+    return id
+
+def test_first_sync_inserts_every_chunk(app, store):
+    count, inserted, errors = app.sync_chunks(["a", "b", "c"], SOURCE)
+    assert (count, inserted, errors) == (3, 3, [])
+    assert chunks_in(store) == [(0, "a"), (1, "b"), (2, "c")]
+
+def test_unchanged_sync_keeps_objects(app, store):
+    app.sync_chunks(["a", "b", "c"], SOURCE)
+    ids = {id for id, _ in store.select("DocumentChunk")}
+
+    count, inserted, errors = app.sync_chunks(["a", "b", "c"], SOURCE)
+
+    assert (count, inserted, errors) == (3, 0, [])
+    assert {id for id, _ in store.select("DocumentChunk")} == ids
+
+def test_inserted_chunk_renumbers_the_following_ones(app, store):
+    app.sync_chunks(["a", "b", "c"], SOURCE)
+    kept = {o["text"]: id for id, o in store.select("DocumentChunk")}
+
+    _, inserted, _ = app.sync_chunks(["new", "a", "b", "c"], SOURCE)
+
+    assert inserted == 1
+    assert chunks_in(store) == [(0, "new"), (1, "a"), (2, "b"), (3, "c")]
+    # i chunk spostati sono gli stessi oggetti (stesso vettore), con chunk_id aggiornato
+    assert all(kept[o["text"]] == id for id, o in store.select("DocumentChunk") if o["text"] != "new")
+
+def test_vanished_chunks_are_deleted(app, store):
+    app.sync_chunks(["a", "b", "c", "d"], SOURCE)
+    app.sync_chunks(["a", "c"], SOURCE)
+    assert chunks_in(store) == [(0, "a"), (1, "c")]
+
+def test_other_sources_are_untouched(app, store):
+    put_chunk(store, 0, "a", "/docs/b.txt")
+    app.sync_chunks(["x"], SOURCE)
+    assert chunks_in(store, "/docs/b.txt") == [(0, "a")]
+
+def test_repeated_chunks_are_matched_one_to_one(app, store):
+    app.sync_chunks(["a", "a", "b"], SOURCE)
+    _, inserted, _ = app.sync_chunks(["a", "b", "a", "a"], SOURCE)
+    assert inserted == 1
+    assert chunks_in(store) == [(0, "a"), (1, "b"), (2, "a"), (3, "a")]
+
+def test_chunks_moved_beyond_the_window_are_reinserted(app, store):
+    texts = [f"chunk {i}" for i in range(10)]
+    app.sync_chunks(texts, SOURCE)
+
+    _, inserted, _ = app.sync_chunks(["x", "y", "z"] + texts, SOURCE, window=2)
+
+    assert inserted == 13
+    assert chunks_in(store) == list(enumerate(["x", "y", "z"] + texts))
+
+def test_chunks_within_the_window_are_kept(app, store):
+    texts = [f"chunk {i}" for i in range(10)]
+    app.sync_chunks(texts, SOURCE)
+
+    _, inserted, _ = app.sync_chunks(["x", "y"] + texts, SOURCE, window=2)
+
+    assert inserted == 2
+    assert chunks_in(store) == list(enumerate(["x", "y"] + texts))
+
+def test_more_chunks_than_a_page(app, store):
+    app.batch_size = 7
+    texts = [f"chunk {i}" for i in range(2500)]
+    app.sync_chunks(texts, SOURCE)
+
+    _, inserted, _ = app.sync_chunks(texts[1:], SOURCE)
+
+    assert inserted == 0
+    assert chunks_in(store) == list(enumerate(texts[1:]))
+
+def test_iter_chunks_pages_by_chunk_id(app, store):
+    for i in range(7):
+        put_chunk(store, i, f"t{i}")
+    # chunk_id duplicato a cavallo tra due pagine
+    put_chunk(store, 2, "again")
+
+    chunks = list(app.iter_chunks_by_file_path(SOURCE, page_size=3))
+
+    assert sorted(o["chunk_id"] for o in chunks) == [0, 1, 2, 2, 3, 4, 5, 6]
+    assert len({o["_additional"]["id"] for o in chunks}) == 8
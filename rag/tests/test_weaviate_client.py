@@ -0,0 +1,109 @@
+import json
+import os
+
+import httpx
+import pytest
+from requests.exceptions import Timeout
+
+from rag.weaviate_client import BatchSizer, WeaviateClient, build_search_query, query_variables
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "..", "rag", "schema.json")
+
+def test_batch_sizer_halves_on_retryable_errors():
+    sizer = BatchSizer(batch_size=100, max_batch_size=1000)
+    assert sizer.retry(None)
+    assert sizer.size == 50
+    assert sizer.retry(503)
+    assert sizer.retry(413)
+    assert sizer.size == 12
+    assert not sizer.retry(400)
+    assert sizer.size == 12
+
+def test_batch_sizer_never_grows_back_to_a_failed_size():
+    sizer = BatchSizer(batch_size=100, max_batch_size=1000, target_seconds=2.0)
+    sizer.update(0.1)
+    assert sizer.size == 200
+    sizer.retry(None)
+    sizer.update(0.1)
+    assert sizer.size == 100
+
+def test_batch_sizer_shrinks_slow_batches_and_stops_at_one():
+    sizer = BatchSizer(batch_size=2, target_seconds=2.0)
+    sizer.update(3.0)
+    assert sizer.size == 1
+    assert not sizer.retry(None)
+
+def http2_client(handler) -> WeaviateClient:
+    # sessione httpx con trasporto finto, come quella creata da build_session con http2=True
+    client = WeaviateClient("http://weaviate.test", None)
+    client.http2 = True
+    client.session = httpx.Client(transport=httpx.MockTransport(handler))
+    return client
+
+def test_ingest_batch_shrinks_on_httpx_timeout():
+    sizes = []
+
+    def handler(request):
+        objects = json.loads(request.content)["objects"]
+        sizes.append(len(objects))
+        if len(objects) > 25:
+            raise httpx.ReadTimeout("timed out", request=request)
+        return httpx.Response(200, json=[{**o, "result": {}} for o in objects])
+
+    client = http2_client(handler)
+    results, errors = client.ingest_batch("DocumentChunk", [{"text": str(i)} for i in range(60)], batch_size=100)
+
+    assert errors == []
+    assert len(results) == 60
+    assert sizes[:3] == [60, 50, 25]
+    assert max(sizes[3:]) <= 25
+
+def test_httpx_timeout_is_raised_as_requests_timeout():
+    def handler(request):
+        raise httpx.ConnectTimeout("timed out", request=request)
+
+    client = http2_client(handler)
+    with pytest.raises(Timeout):
+        client.get_schema()
+
+def test_apply_schema_adds_missing_properties(app, store):
+    with open(SCHEMA_PATH, encoding="utf-8") as f:
+        definitions = json.load(f)
+    client = app.get_weaviate_client()
+
+    # installazione precedente: DocumentChunk senza chunk_hash, Document senza prehash
+    old = json.loads(json.dumps(definitions))
+    old["DocumentChunk"]["properties"] = [p for p in old["DocumentChunk"]["properties"] if p["name"] != "chunk_hash"]
+    old["Document"]["properties"] = [p for p in old["Document"]["properties"] if p["name"] != "prehash"]
+    created, _, _, _ = client.apply_schema(old)
+    assert set(created) == {"Document", "DocumentChunk"}
+
+    created, skipped, failed, added = client.apply_schema(definitions)
+
+    assert (created, skipped, failed) == ({}, [], [])
+    assert added == {"Document": ["prehash"], "DocumentChunk": ["chunk_hash"]}
+    assert "chunk_hash" in {p["name"] for p in client.get_class("DocumentChunk")["properties"]}
+
+    _, skipped, _, added = client.apply_schema(definitions)
+    assert skipped == ["Document", "DocumentChunk"]
+    assert added == {}
+
+def test_limit_offset_and_sort_are_written_into_the_query():
+    variables = {
+        "where": {"operator": "Equal", "path": ["source"], "valueString": "/a"},
+        "limit": 5,
+        "offset": 10,
+        "sort": [{"path": ["chunk_id"], "order": "asc"}]
+    }
+    q = build_search_query("DocumentChunk", variables, ["chunk_id"], ["id"])
+
+    assert "$where: GetObjectsDocumentChunkWhereInpObj!" in q
+    assert "$limit" not in q and "$offset" not in q
+    assert "limit: 5" in q and "offset: 10" in q
+    assert 'sort: [{path: ["chunk_id"], order: asc}]' in q
+    assert query_variables(variables) == {"where": variables["where"]}
+
+def test_compiled_query_is_reused_for_the_same_shape():
+    first = build_search_query("DocumentChunk", {"nearText": {"concepts": ["a"]}, "limit": 3}, ["text"], ["id"])
+    second = build_search_query("DocumentChunk", {"nearText": {"concepts": ["b"]}, "limit": 3}, ["text"], ["id"])
+    assert first is second